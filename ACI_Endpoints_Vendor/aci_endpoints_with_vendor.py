@@ -11,9 +11,444 @@
 Simple application to display details about endpoints
 """
 import acitoolkit.acitoolkit as aci
-from tabulate import tabulate
+import argparse
 import requests
 import time
+import csv
+import json
+import os
+import re
+import threading
+import fnmatch
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+from tabulate import tabulate
+
+# IEEE assignment sizes in hex digits, longest match first: MA-S (36-bit), MA-M (28-bit), MA-L (24-bit)
+oui_prefix_lengths = (9, 7, 6)
+oui_txt_entry = re.compile(r'^\s*([0-9A-F]{2}-[0-9A-F]{2}-[0-9A-F]{2})\s+\(hex\)\s+(.*)$', re.MULTILINE | re.IGNORECASE)
+vendor_cache_filename = "aci_endpoints_vendor_cache.json" # Default persistent cache of remote vendor lookups, keyed by OUI
+registration_authority = "IEEE Registration Authority" # MA-L owner of the OUIs that are split into MA-M and MA-S blocks
+vendor_url_default = "http://api.macvendors.com/" # Remote vendor lookup API. MAC address is appended to the URL
+
+def load_oui_database(oui_files):
+    '''
+    Load the IEEE registry files into an in-memory index, keyed by the 24/28/36-bit prefix as an integer
+
+    Supports the IEEE CSV exports (oui.csv, mam.csv, oui36.csv) and the classic oui.txt format
+    '''
+    oui_index = dict((prefix_length, {}) for prefix_length in oui_prefix_lengths)
+    vendor_names = {} # Many assignments share the same organization, so only keep a single copy of each name
+
+    for oui_file in oui_files:
+        with open(oui_file) as registry:
+            if oui_file.lower().endswith(".csv"):
+                # Registry,Assignment,Organization Name,Organization Address
+                # MA-L,002272,American Micro-Fuel Device Corp.,...
+                entries = [(row[1], row[2]) for row in csv.reader(registry) if len(row) >= 3]
+            else:
+                # 00-22-72   (hex)\t\tAmerican Micro-Fuel Device Corp.
+                entries = oui_txt_entry.findall(registry.read())
+
+            for assignment, vendor in entries:
+                assignment = assignment.replace("-", "").strip()
+                if len(assignment) not in oui_index or not re.match(r'^[0-9A-Fa-f]+$', assignment):
+                    # Header line or an entry that is not a valid assignment
+                    continue
+                # The registry files are UTF-8, keep the names as unicode like the remote and cached vendors
+                vendor = vendor.strip().decode("utf-8", "replace")
+                oui_index[len(assignment)][int(assignment, 16)] = vendor_names.setdefault(vendor, vendor)
+
+    return oui_index
+
+
+def lookup_mac_vendor(oui_index, mac):
+    '''
+    Return the vendor for a MAC address using the longest matching IEEE assignment, or None if not found
+
+    An MA-L entry of the IEEE Registration Authority only says the OUI is split into MA-M/MA-S blocks, so if the block
+    itself is not loaded (Eg: only oui.csv) the vendor is not found locally
+    '''
+    mac_hex = re.sub(r'[^0-9A-Fa-f]', '', mac)
+    for prefix_length in oui_prefix_lengths:
+        vendor = oui_index[prefix_length].get(int(mac_hex[:prefix_length], 16))
+        if vendor is not None and vendor != registration_authority:
+            return vendor
+    return None
+
+
+def get_oui(mac):
+    '''
+    Return the 24-bit OUI of a MAC address as 6 upper case hex digits. Eg: 00:50:56:AB:CD:EF = 005056
+    '''
+    return re.sub(r'[^0-9A-Fa-f]', '', mac)[:6].upper()
+
+
+def get_registration_ouis(oui_index):
+    '''
+    Return the 24-bit OUIs that are split into MA-M/MA-S blocks, as 6 upper case hex digits
+
+    These are the OUIs registered to the IEEE Registration Authority, plus any OUI with a 28/36-bit assignment loaded
+    '''
+    if oui_index is None:
+        return set()
+
+    registration_ouis = set("{:06X}".format(oui) for oui, vendor in oui_index[6].iteritems() if vendor == registration_authority)
+    registration_ouis.update("{:06X}".format(prefix >> 4) for prefix in oui_index[7])
+    registration_ouis.update("{:06X}".format(prefix >> 12) for prefix in oui_index[9])
+    return registration_ouis
+
+
+def get_vendor_key(mac, registration_ouis):
+    '''
+    Return the prefix a remote vendor result is cached under
+
+    Normally the 24-bit OUI. For an OUI split into MA-M/MA-S blocks each block can belong to a different vendor,
+    so the 36-bit prefix is used instead. Eg: 00:50:56:AB:CD:EF = 005056, 70:B3:D5:12:34:56 = 70B3D5123
+    '''
+    oui = get_oui(mac)
+    if oui in registration_ouis:
+        return re.sub(r'[^0-9A-Fa-f]', '', mac)[:9].upper()
+    return oui
+
+
+def load_vendor_cache(cache_file, ttl):
+    '''
+    Read the persistent vendor cache, discarding any entries older than the TTL (in seconds)
+
+    Cache format: {"005056": ["VMware, Inc.", <time resolved>], "70B3D5123": [<MA-S vendor>, <time resolved>]}
+    '''
+    if not os.path.isfile(cache_file):
+        return {}
+
+    with open(cache_file) as json_file:
+        vendor_cache = json.load(json_file)
+
+    oldest_allowed = time.time() - ttl
+    return dict((oui, entry) for oui, entry in vendor_cache.iteritems() if entry[1] >= oldest_allowed)
+
+
+def write_vendor_cache(cache_file, vendor_cache, max_entries):
+    '''
+    Save the vendor cache for the next run. Once above the maximum size, the oldest resolved entries are evicted
+    '''
+    if len(vendor_cache) > max_entries:
+        newest_entries = sorted(vendor_cache.iteritems(), key=lambda item: item[1][1], reverse=True)[:max_entries]
+        vendor_cache = dict(newest_entries)
+
+    with open(cache_file, 'w') as outfile:
+        json.dump(vendor_cache, outfile, separators=(',', ':'))
+
+
+class TokenBucket(object):
+    '''
+    Thread safe token bucket, to keep the concurrent remote vendor lookups under the API rate limit
+    '''
+    def __init__(self, rate, burst):
+        self.rate = float(rate) # Tokens added per second
+        self.capacity = float(burst) # Maximum tokens that can be saved up, allowing short bursts
+        self.tokens = float(burst)
+        self.last_update = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''
+        Block until a token is available and then consume it
+        '''
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+                self.last_update = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def lookup_remote_vendor(mac, vendor_url, rate_limiter, retries):
+    '''
+    Check a MAC address via API call to macvendors.com (or vendor_url) to identify hardware vendor
+
+    HTTP 429 and server errors are retried with exponential backoff, honouring any Retry-After header.
+    Returns None if the lookup failed, so the result is not cached and is retried on the next run
+    '''
+    for attempt in range(retries + 1):
+        rate_limiter.acquire()
+        try:
+            response = requests.request("GET", vendor_url + mac, timeout=10)
+        except requests.exceptions.RequestException:
+            response = None
+
+        if response is not None:
+            if response.ok:
+                return response.text
+            elif response.status_code == 404:
+                # OUI is not registered, which is also a valid answer worth caching
+                return "Unknown"
+            elif response.status_code != 429 and response.status_code < 500:
+                return None
+
+        if attempt < retries:
+            backoff = 2 ** attempt
+            if response is not None and response.headers.get("Retry-After", "").isdigit():
+                backoff = max(backoff, int(response.headers["Retry-After"]))
+            time.sleep(backoff)
+
+    return None
+
+
+def resolve_vendors(macs, oui_index, registration_ouis, vendor_cache, cache_stats, seen_ouis):
+    '''
+    Collapse the list of MAC addresses to the unique OUIs not yet resolved locally, in the cache or in a previous batch
+
+    Updates the cache hit and miss counts (per unique OUI) and returns the OUIs that still need a remote lookup,
+    mapped to a representative MAC address. See get_vendor_key for the OUIs split into MA-M/MA-S blocks, whose MAC addresses
+    reach this point when only the MA-L registry is loaded
+    '''
+    pending_ouis = {}
+
+    for mac in macs:
+        if oui_index is not None and lookup_mac_vendor(oui_index, mac) is not None:
+            continue
+        oui = get_vendor_key(mac, registration_ouis)
+        if oui in seen_ouis:
+            continue
+        seen_ouis.add(oui)
+        if oui in vendor_cache:
+            cache_stats["hit"] += 1
+        else:
+            cache_stats["miss"] += 1
+            pending_ouis[oui] = mac
+
+    return pending_ouis
+
+
+def resolve_remote_vendors(pending_ouis, vendor_cache, vendor_url, rate, workers, retries):
+    '''
+    Resolve the remaining unique OUIs concurrently on a thread pool, under a shared token bucket rate limit
+
+    Successful lookups are added to the vendor cache. Returns the number of OUIs that could not be resolved
+    '''
+    if len(pending_ouis) == 0:
+        return 0
+
+    rate_limiter = TokenBucket(rate, max(1, int(rate)))
+    pending = list(pending_ouis.iteritems())
+
+    pool = ThreadPool(max(1, min(workers, len(pending))))
+    try:
+        results = pool.map(lambda item: lookup_remote_vendor(item[1], vendor_url, rate_limiter, retries), pending)
+    finally:
+        pool.close()
+
+    failed = 0
+    for (oui, mac), mac_vendor in zip(pending, results):
+        if mac_vendor is None:
+            failed += 1
+        else:
+            vendor_cache[oui] = [mac_vendor, time.time()]
+
+    return failed
+
+
+def get_vendor(mac, oui_index, registration_ouis, vendor_cache):
+    '''
+    Return the vendor of a MAC address from the local OUI database, otherwise from the vendor cache
+    '''
+    if oui_index is not None:
+        mac_vendor = lookup_mac_vendor(oui_index, mac)
+        if mac_vendor is not None:
+            return mac_vendor
+    return vendor_cache.get(get_vendor_key(mac, registration_ouis), ["Unknown"])[0]
+
+
+def get_interface_name(path_dn):
+    '''
+    Convert the fvRsCEpToPathEp target DN into an interface name, in the same format as the ACI Toolkit
+
+    Eg: topology/pod-1/paths-101/pathep-[eth1/10] = eth 1/101/1/10
+        topology/pod-1/protpaths-101-102/pathep-[vpc-web] = vpc-web
+    '''
+    match = re.match(r'^topology/pod-([0-9]+)/paths-([0-9]+)/pathep-\[eth([0-9/]+)\]$', path_dn)
+    if match:
+        return "eth {}/{}/{}".format(match.group(1), match.group(2), match.group(3))
+
+    match = re.search(r'/pathep-\[(.+)\]$', path_dn)
+    if match:
+        return match.group(1)
+    return path_dn
+
+
+def get_leaf(path):
+    '''
+    Return the leaf Node ID/s an endpoint is learnt on, from either the path DN or the ACI Toolkit interface name
+
+    Eg: topology/pod-1/protpaths-101-102/pathep-[vpc-web] = 101-102
+        eth 1/101/1/10 = 101
+    '''
+    match = re.search(r'/(?:prot)?paths-([0-9-]+)/', path or "") or re.match(r'^eth [0-9]+/([0-9]+)/', path or "")
+    if match:
+        return match.group(1)
+    return ""
+
+
+def get_endpoint_pages(session, page_size):
+    '''
+    Generator returning the endpoints one page at a time, from paginated fvCEp class queries (with the fvRsCEpToPathEp / fvIp children)
+
+    Tenant / App Profile / EPG are taken from the fvCEp DN, instead of building the ACI Toolkit object model for each endpoint
+    Each row: (mac, ip, interface, encap, tenant, app profile, epg, leaf)
+    '''
+    base_url = '/api/node/class/fvCEp.json?rsp-subtree=children&rsp-subtree-class=fvRsCEpToPathEp,fvIp&order-by=fvCEp.dn'
+    page = 0
+
+    while True:
+        my_url = base_url + '&page-size={}&page={}'.format(page_size, page)
+        ret = session.get(my_url)
+        response = ret.json()
+        imdata = response['imdata']
+
+        rows = []
+        for entry in imdata:
+            attributes = entry["fvCEp"]["attributes"]
+
+            # uni/tn-mipetrin/ap-mipetrin-App/epg-EPG-Web/cep-00:50:56:AB:CD:EF
+            match = re.match(r'^uni/tn-([^/]+)/ap-([^/]+)/epg-([^/]+)/', attributes["dn"])
+            if match:
+                tenant, app_profile, epg = match.groups()
+            else:
+                # Endpoint not learnt within an App Profile / EPG. Eg: L2out
+                split_dn = attributes["dn"].split("/")
+                tenant, app_profile, epg = split_dn[1][len("tn-"):], "", split_dn[-2]
+
+            ips = []
+            interfaces = []
+            leaves = []
+            for child in entry["fvCEp"].get("children", []):
+                if "fvIp" in child:
+                    ips.append(child["fvIp"]["attributes"]["addr"])
+                elif "fvRsCEpToPathEp" in child:
+                    interfaces.append(get_interface_name(child["fvRsCEpToPathEp"]["attributes"]["tDn"]))
+                    leaves.append(get_leaf(child["fvRsCEpToPathEp"]["attributes"]["tDn"]))
+
+            rows.append((attributes["mac"], ", ".join(ips) or attributes["ip"], ", ".join(interfaces), attributes["encap"],
+                         tenant, app_profile, epg, ", ".join(leaves)))
+
+        yield rows
+
+        page += 1
+        if len(imdata) < page_size or page * page_size >= int(response['totalCount']):
+            break
+
+
+def print_endpoint_rows(data, print_headers):
+    '''
+    Print the endpoint rows in fixed width columns, so each page can be printed as soon as it is received
+
+    Vendor names can contain non-ASCII characters, so the rows are formatted as unicode and printed as UTF-8
+    '''
+    row_format = u"{:<17}  {:<30}  {:<15}  {:<16}  {:<12}  {:<20}  {:<20}  {}"
+    if print_headers:
+        print (row_format.format("MACADDRESS", "MAC VENDOR", "IPADDRESS", "INTERFACE", "ENCAP", "TENANT", "APP PROFILE", "EPG").encode("utf-8"))
+        print (row_format.format("-" * 17, "-" * 30, "-" * 15, "-" * 16, "-" * 12, "-" * 20, "-" * 20, "-" * 20).encode("utf-8"))
+    for row in data:
+        print (row_format.format(*[field if field is not None else "" for field in row[:8]]).encode("utf-8"))
+
+
+def new_rollup():
+    '''
+    Return an empty vendor roll-up. Memory is bounded by the number of distinct groups, not the number of endpoints
+    '''
+    return {"vendor": Counter(), "tenant": Counter(), "epg": Counter(), "leaf": Counter(), "unexpected": Counter()}
+
+
+def update_rollup(rollup, data, sensitive_epgs, expected_vendors):
+    '''
+    Add a page of endpoint rows to the vendor roll-up counters, in a single pass
+
+    Vendors seen in a sensitive EPG (Tenant/AppProfile/EPG, wildcards allowed) that do not match any of the
+    expected vendors are counted as unexpected
+    '''
+    for mac, mac_vendor, ip, interface, encap, tenant, app_profile, epg, leaf in data:
+        rollup["vendor"][mac_vendor] += 1
+        rollup["tenant"][(tenant, mac_vendor)] += 1
+        rollup["epg"][(tenant, app_profile, epg, mac_vendor)] += 1
+        rollup["leaf"][(leaf, mac_vendor)] += 1
+
+        if sensitive_epgs:
+            epg_path = "{}/{}/{}".format(tenant, app_profile, epg)
+            if any(fnmatch.fnmatch(epg_path, sensitive_epg) for sensitive_epg in sensitive_epgs):
+                if not any(expected_vendor.lower() in mac_vendor.lower() for expected_vendor in expected_vendors):
+                    rollup["unexpected"][(tenant, app_profile, epg, mac_vendor)] += 1
+
+
+def print_rollup(rollup):
+    '''
+    Print the vendor roll-up as tables, largest counts first
+    '''
+    sections = [
+        ("vendor", "Endpoints per Vendor", ["MAC VENDOR"]),
+        ("tenant", "Endpoints per Vendor per Tenant", ["TENANT", "MAC VENDOR"]),
+        ("epg", "Endpoints per Vendor per EPG", ["TENANT", "APP PROFILE", "EPG", "MAC VENDOR"]),
+        ("leaf", "Endpoints per Vendor per Leaf", ["LEAF", "MAC VENDOR"]),
+        ("unexpected", "Unexpected Vendors in Sensitive EPGs", ["TENANT", "APP PROFILE", "EPG", "MAC VENDOR"]),
+    ]
+    for key, title, headers in sections:
+        print ("=" * 80)
+        print (title)
+        print ("=" * 80)
+        if len(rollup[key]) == 0:
+            print ("N/A")
+            continue
+        table = []
+        for group, count in sorted(rollup[key].iteritems(), key=lambda item: (-item[1], item[0])):
+            if not isinstance(group, tuple):
+                group = (group,)
+            table.append(group + (count,))
+        print (tabulate(table, headers=headers + ["COUNT"], tablefmt="simple").encode("utf-8"))
+
+
+def write_rollup(rollup, my_output_file):
+    '''
+    Save the vendor roll-up as machine-readable JSON
+    '''
+    group_fields = {
+        "vendor": ["vendor"],
+        "tenant": ["tenant", "vendor"],
+        "epg": ["tenant", "app_profile", "epg", "vendor"],
+        "leaf": ["leaf", "vendor"],
+        "unexpected": ["tenant", "app_profile", "epg", "vendor"],
+    }
+    my_data = {}
+    for key, fields in group_fields.iteritems():
+        my_data[key] = []
+        for group, count in sorted(rollup[key].iteritems(), key=lambda item: (-item[1], item[0])):
+            if not isinstance(group, tuple):
+                group = (group,)
+            entry = dict(zip(fields, group))
+            entry["count"] = count
+            my_data[key].append(entry)
+
+    with open(my_output_file, 'w') as outfile:
+        json.dump(my_data, outfile, indent=2)
+
+    print ("Output File Generated: {}".format(my_output_file))
+
+
+def positive_rate(value):
+    '''
+    Argument type for --rate, which must be a number of lookups per second greater than zero
+    '''
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = 0
+    if not 0 < rate < float("inf"):
+        raise argparse.ArgumentTypeError("must be a number greater than 0, got '{}'".format(value))
+    return rate
+
 
 def main():
     """
@@ -24,6 +459,21 @@ def main():
 
     description = ('Simple application to display details about endpoints')
     creds = aci.Credentials('apic', description)
+    creds.add_argument('--oui-file', dest="oui_file", nargs='+', help='Resolve MAC vendors locally from IEEE registry files (oui.csv, mam.csv, oui36.csv or oui.txt) instead of api.macvendors.com')
+    creds.add_argument('--offline', action='store_true', help='Never perform remote vendor lookups. Vendors not found locally or in the cache are reported as Unknown')
+    creds.add_argument('--cache-file', dest="cache_file", default=vendor_cache_filename, help='Persistent cache of remote vendor lookups, keyed by OUI. Default = {}'.format(vendor_cache_filename))
+    creds.add_argument('--cache-ttl', dest="cache_ttl", type=int, default=30, help='Number of days a cached vendor remains valid. Default = 30')
+    creds.add_argument('--cache-size', dest="cache_size", type=int, default=50000, help='Maximum number of OUIs kept in the cache. Default = 50000')
+    creds.add_argument('--vendor-url', dest="vendor_url", default=vendor_url_default, help='Remote vendor lookup API, the MAC address is appended. Default = {}'.format(vendor_url_default))
+    creds.add_argument('--rate', type=positive_rate, default=1.0, help='Maximum remote vendor lookups per second. Must be greater than 0 (eg: 0.5 = one lookup every 2 seconds). Default = 1')
+    creds.add_argument('--workers', type=int, default=8, help='Number of concurrent remote vendor lookups. Default = 8')
+    creds.add_argument('--retries', type=int, default=3, help='Number of retries for a remote vendor lookup that is rate limited (HTTP 429) or fails. Default = 3')
+    creds.add_argument('--page-size', dest="page_size", type=int, default=10000, help='Number of endpoints retrieved per fvCEp query. Default = 10000')
+    creds.add_argument('--rollup', action='store_true', help='Print the counts of endpoints per vendor per Tenant/EPG/Leaf instead of the per endpoint table')
+    creds.add_argument('--rollup-json', dest="rollup_json", help='Also write the roll-up to this file as JSON')
+    creds.add_argument('--sensitive-epg', dest="sensitive_epg", nargs='+', default=[], help='EPGs where only the --expected-vendor are allowed. Format: Tenant/AppProfile/EPG, wildcards allowed. Eg: "Prod/*/PCI-*"')
+    creds.add_argument('--expected-vendor', dest="expected_vendor", nargs='+', default=[], help='Vendors expected in the --sensitive-epg. Matches any part of the vendor name, case insensitive')
+    creds.add_argument('--object-model', dest="object_model", action='store_true', help='Build the full ACI Toolkit object model for each endpoint instead of the bulk fvCEp query (slower)')
     args = creds.get()
 
     # Login to APIC
@@ -37,26 +487,59 @@ def main():
     # Start time count at this point, otherwise takes into consideration the amount of time taken to input the password
     start_time = time.time()
 
-    # Download all of the interfaces and store the data as tuples in a list
-    data = []
-    endpoints = aci.Endpoint.get(session)
-    for ep in endpoints:
-        epg = ep.get_parent()
-        app_profile = epg.get_parent()
-        tenant = app_profile.get_parent()
-
-        # Check each MAC address via API call to macvendors.com to identify hardware vendor
-        url = "http://api.macvendors.com/" + ep.mac
-        response = requests.request("GET", url)
-        mac_vendor = response.text
-
-        # Store in list as tuple, that will be printed in the tabulate format
-        data.append((ep.mac, mac_vendor, ep.ip, ep.if_name, ep.encap,
-                    tenant.name, app_profile.name, epg.name))
-
-    # Display the data downloaded
-    print tabulate(data, headers=["MACADDRESS", "MAC VENDOR", "IPADDRESS", "INTERFACE",
-                                  "ENCAP", "TENANT", "APP PROFILE", "EPG"], tablefmt="simple")
+    # Load the local OUI database once, so each vendor lookup is then an in-memory operation
+    oui_index = None
+    if args.oui_file:
+        oui_index = load_oui_database(args.oui_file)
+        print ("Loaded OUI database: " + ", ".join("{} x {}-bit".format(len(oui_index[prefix_length]), prefix_length * 4) for prefix_length in oui_prefix_lengths))
+    registration_ouis = get_registration_ouis(oui_index)
+
+    # Re-use the vendor results of previous runs
+    vendor_cache = load_vendor_cache(args.cache_file, args.cache_ttl * 86400)
+    cache_stats = {"hit": 0, "miss": 0}
+    seen_ouis = set()
+    failed_lookups = 0
+    endpoint_count = 0
+    rollup = new_rollup()
+
+    if args.object_model:
+        # Download all of the interfaces as ACI Toolkit objects, and walk up to the EPG / App Profile / Tenant of each
+        pages = [[]]
+        for ep in aci.Endpoint.get(session):
+            epg = ep.get_parent()
+            app_profile = epg.get_parent()
+            tenant = app_profile.get_parent()
+            pages[0].append((ep.mac, ep.ip, ep.if_name, ep.encap, tenant.name, app_profile.name, epg.name, get_leaf(ep.if_name)))
+    else:
+        # Download the endpoints page by page, each page is printed before the next is requested
+        pages = get_endpoint_pages(session, args.page_size)
+
+    for page_number, rows in enumerate(pages):
+        # Resolve the vendor of each unique OUI only once
+        pending_ouis = resolve_vendors([row[0] for row in rows], oui_index, registration_ouis, vendor_cache, cache_stats, seen_ouis)
+        if not args.offline:
+            failed_lookups += resolve_remote_vendors(pending_ouis, vendor_cache, args.vendor_url, args.rate, args.workers, args.retries)
+
+        # Display the data downloaded, with the vendor after the MAC address
+        data = [(row[0], get_vendor(row[0], oui_index, registration_ouis, vendor_cache)) + row[1:] for row in rows]
+        if args.rollup or args.rollup_json:
+            update_rollup(rollup, data, args.sensitive_epg, args.expected_vendor)
+        else:
+            print_endpoint_rows(data, page_number == 0)
+        endpoint_count += len(data)
+
+    write_vendor_cache(args.cache_file, vendor_cache, args.cache_size)
+
+    if args.rollup or args.rollup_json:
+        print_rollup(rollup)
+    if args.rollup_json:
+        write_rollup(rollup, args.rollup_json)
+
+    print ("=" * 80)
+    print ("Total Endpoints: {}".format(endpoint_count))
+    print ("Vendor cache: {} hits, {} misses (unique OUIs)".format(cache_stats["hit"], cache_stats["miss"]))
+    print ("Remote vendor lookups failed: {} (reported as Unknown)".format(failed_lookups))
+    print ("=" * 80)
 
     print ("#" * 80)
     finish_time = time.time()
@@ -50,6 +50,7 @@ import time
 import sys
 import json
 import re
+import hashlib
 import os
 import logging
 from pprint import pprint
@@ -67,6 +68,9 @@ debug = False
 instance = 0
 global_vlanCktEp = []
 logging_filename = "" # Filename to be used if --log option used. Set during setup_logger()
+findings = {} # Stable finding records for this run, keyed by hash. Eg: {"9f2c...": [check, object_dn, nodes, expected, actual]}
+findings_filename = "fabric_programming_findings.json" # Default findings store, used by --since-last to compare against the previous run
+all_checks = ["EPG_VXLAN_ENCAP", "BD_VXLAN_ENCAP", "VZANY_MISSING", "EPG_ENCAP_MISSING", "EPG_BD_MAPPING"]
 
 # Create a custom logger
 logger = logging.getLogger(__name__)
@@ -320,6 +324,11 @@ def EPG_VXLAN_ENCAP(session):
                 for vxlan, node_ids in tmp_vnids.iteritems():
                     logger.info("---- {}, Node IDs: {}".format(vxlan, sorted(node_ids)))
                     vxlan_vnid_counter += 1
+
+            # Record a stable finding for this EPG, so it can be compared across runs via --since-last
+            actual_vnids = ["{}: {}".format(vxlan, ",".join(sorted(node_ids))) for vxlan, node_ids in sorted(tmp_vnids.iteritems())]
+            all_node_ids = [node_id for node_ids in tmp_vnids.values() for node_id in node_ids]
+            record_finding("EPG_VXLAN_ENCAP", item["epgDn"], all_node_ids, "Single VXLAN VNID", "; ".join(actual_vnids))
             logger.info("\n")
         logger.info("'{}' EPGs found to have issues, across {} VXLAN VNIDs".format(len(result), vxlan_vnid_counter))
 
@@ -418,6 +427,11 @@ def BD_VXLAN_ENCAP(session):
                 for vxlan, node_ids in tmp_vnids.iteritems():
                     logger.info("---- {}, Node IDs: {}".format(vxlan, sorted(node_ids)))
                     vxlan_vnid_counter += 1
+
+            # Record a stable finding for this EPG, so it can be compared across runs via --since-last
+            actual_vnids = ["{}: {}".format(vxlan, ",".join(sorted(node_ids))) for vxlan, node_ids in sorted(tmp_vnids.iteritems())]
+            all_node_ids = [node_id for node_ids in tmp_vnids.values() for node_id in node_ids]
+            record_finding("BD_VXLAN_ENCAP", item["epgDn"], all_node_ids, "Single VXLAN VNID", "; ".join(actual_vnids))
             logger.info("\n")
         logger.info("'{}' EPGs found to have issues, across {} VXLAN VNIDs".format(len(result), vxlan_vnid_counter))
 
@@ -617,6 +631,8 @@ def VZANY_MISSING(session):
                 logger.info("     Actual: {}".format(sorted(deployed_node_ids)))
                 logger.info("       Diff: {}".format(sorted(list_diff(sorted(item_nodes), sorted(deployed_node_ids)))))
                 logger.info("#" * 25)
+                record_finding("VZANY_MISSING", "{}/{} (Scope {})".format(actrl_name, actrl_vrf, item_scope), list_diff(item_nodes, deployed_node_ids),
+                               sorted(set(item_nodes)), sorted(set(deployed_node_ids)))
                 different_nodes_counter += 1
         else:
             # This VRF/Scope does NOT have a default contract but the VRF is deployed on various Nodes
@@ -667,6 +683,8 @@ def VZANY_MISSING(session):
             # Found a tenant / context possible missing a "any_any_any" contract rule
             logger.debug("(ScopeID: {})  Tenant Name: {}  ==  VRF Name: {}".format(scopeId, tenant_vrf["name"], tenant_vrf["vrf"]))
             possibly_missing_contract.append((tenant_vrf["name"], tenant_vrf["vrf"], scopeId))
+            record_finding("VZANY_MISSING", "{}/{} (Scope {})".format(tenant_vrf["name"], tenant_vrf["vrf"], scopeId), [],
+                           "default permit {} contract".format(contract_search_type), "Missing")
             #missing_counter += 1
 
     ### Print out invalid VRFs and the Nodes found on
@@ -676,6 +694,7 @@ def VZANY_MISSING(session):
         # Print each one out
         logger.info("++ " + scopeId_key)
         logger.info("---- Node IDs: {}".format(sorted(node_values)))
+        record_finding("VZANY_MISSING", "Scope {}".format(scopeId_key), node_values, "Valid VRF ScopeID", "Stale H/W entry")
         logger.info("Verify with apic# moquery -c fvCtx -f 'fv.Ctx.scope==\"{}\"'\n".format(scopeId_key))
 
     logger.info("#" * 80)
@@ -940,6 +959,8 @@ def EPG_ENCAP_MISSING(session):
                 logger.info("     Actual: {}".format(sorted(vlanCktEp_dict[item_dn])))
                 logger.info("       Diff: {}".format(sorted(list_diff(sorted(item_nodes), sorted(vlanCktEp_dict[item_dn])))))
                 logger.info("#" * 25)
+                record_finding("EPG_ENCAP_MISSING", item_dn, list_diff(item_nodes, vlanCktEp_dict[item_dn]),
+                               sorted(set(item_nodes)), sorted(set(vlanCktEp_dict[item_dn])))
                 different_nodes_counter += 1
         else:
             # This fvLocale EPG DN does NOT exist in concrete vlanCktEp
@@ -949,6 +970,7 @@ def EPG_ENCAP_MISSING(session):
             logger.info("Not found programmed on any node for EPG: {}".format(item_dn))
             logger.info("   Expected Nodes: {}".format(sorted(item_nodes)))
             logger.info("#" * 25)
+            record_finding("EPG_ENCAP_MISSING", item_dn, item_nodes, sorted(set(item_nodes)), "Not programmed on any node")
             no_nodes_counter += 1
 
     #print ("#" * 80)
@@ -972,6 +994,88 @@ def list_diff(li1, li2):
     return (list(set(li1) - set(li2)))
 
 
+def record_finding(check, object_dn, nodes, expected, actual):
+    '''
+    Store a stable finding record for the current run, keyed by a hash of its contents
+
+    The same issue found on a subsequent run produces the same hash, so runs can be compared with simple set operations
+    '''
+    # Lists of Node IDs are flattened, so that expected/actual are always simple strings within the record
+    if isinstance(expected, list):
+        expected = ",".join(str(item) for item in expected)
+    if isinstance(actual, list):
+        actual = ",".join(str(item) for item in actual)
+
+    record = [str(check), str(object_dn), sorted(set(str(node) for node in nodes)), str(expected), str(actual)]
+    finding_hash = hashlib.sha1(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    findings[finding_hash] = record
+    return finding_hash
+
+
+def load_findings(my_file):
+    '''
+    Read the findings store written by a previous run. Returns an empty store if no previous run exists
+    '''
+    if not os.path.isfile(my_file):
+        logger.info("No previous findings file found: {}. All findings will be reported as new".format(my_file))
+        return {"checks": [], "findings": {}}
+
+    with open(my_file) as json_file:
+        return json.load(json_file)
+
+
+def write_findings(my_file, checks_run, previous):
+    '''
+    Save the findings of this run to the compact store. Findings from checks that were NOT run this time are carried forward
+    '''
+    stored_findings = {}
+    for finding_hash, record in previous["findings"].iteritems():
+        if record[0] not in checks_run:
+            stored_findings[finding_hash] = record
+    stored_findings.update(findings)
+
+    checks_stored = sorted(set(previous["checks"]) | set(checks_run))
+    my_data = {"Analysis Time": time.asctime(time.localtime(time.time())), "checks": checks_stored, "findings": stored_findings}
+
+    with open(my_file, 'w') as outfile:
+        json.dump(my_data, outfile, separators=(',', ':'))
+
+    logger.info("Findings File Generated: {} ({} findings)".format(my_file, len(stored_findings)))
+
+
+def report_findings_diff(previous, checks_run):
+    '''
+    Compare the findings of this run against the previous run and report only what is new, resolved and persisting
+
+    Only findings belonging to the checks executed during this run are compared
+    '''
+    previous_hashes = set(finding_hash for finding_hash, record in previous["findings"].iteritems() if record[0] in checks_run)
+    current_hashes = set(findings)
+
+    new_hashes = current_hashes - previous_hashes
+    resolved_hashes = previous_hashes - current_hashes
+    persisting_hashes = current_hashes & previous_hashes
+
+    print_header("Findings since last run ({})".format(previous.get("Analysis Time", "no previous run")))
+
+    for title, hashes, source in (("NEW", new_hashes, findings), ("RESOLVED", resolved_hashes, previous["findings"])):
+        logger.info("\n{} findings: {}".format(title, len(hashes)))
+        if len(hashes) >= 1:
+            rows = sorted(source[finding_hash] for finding_hash in hashes)
+            logger.info(tabulate([(check, dn, ",".join(nodes), expected, actual) for check, dn, nodes, expected, actual in rows],
+                                 headers=["Check", "Object DN", "Nodes", "Expected", "Actual"], tablefmt="simple"))
+
+    # Persisting findings are known issues, so only summarise them per check
+    persisting_count = {}
+    for finding_hash in persisting_hashes:
+        check = findings[finding_hash][0]
+        persisting_count[check] = persisting_count.get(check, 0) + 1
+
+    logger.info("\nPERSISTING findings: {}".format(len(persisting_hashes)))
+    for check in sorted(persisting_count):
+        logger.info("---- {}: {}".format(check, persisting_count[check]))
+
+
 def print_epg_encap_missing(concrete_dictionary):
     '''
     test print function during debugging
@@ -1133,6 +1237,7 @@ def EPG_BD_MAPPING(session):
         else:
             logger.info("Found a BD that isn't in the SegID dictionary due to no target BD DN found on APIC. Manually check that the BD exists")
             logger.info("EPG Name: '{}' is configured for BD: '{}' but the following target BD DN is missing: '{}'\n".format(epg_dn,target_bd_name,target_bd_dn,))
+            record_finding("EPG_BD_MAPPING", epg_dn, [], target_bd_dn, "Target BD DN missing")
             bd_error_counter += 1
 
         logical_epg_bd_mapping_dict[epg_dn].update(logical_encapDict_Tmp)
@@ -1171,6 +1276,7 @@ def EPG_BD_MAPPING(session):
 
                 # instead add this to another list and then summary print at the end or state there are no issues
                 logger.info("#" * 25 + "\n")
+                record_finding("EPG_BD_MAPPING", epg_dn, [node], logical_bd_vxlan, bd_vxlan)
                 mismatch_counter += 1
         else:
             # NOTE need to consider L4-L7 concrete devices?
@@ -1182,6 +1288,7 @@ def EPG_BD_MAPPING(session):
             logger.info("Node {}, EPG '{}'".format(node, epg_dn))
             logger.info("Access Encap: '{}'\n".format(access_encap))
             #logger.info ("Object DN: '{}'".format(object_dn))
+            record_finding("EPG_BD_MAPPING", epg_dn, [node], "Logical EPG to BD mapping", "Not found for {}".format(access_encap))
             error_counter += 1
 
     logger.info("#" * 80)
@@ -1222,6 +1329,8 @@ def main():
     creds.add_argument("--debug", dest="debug", choices=["debug", "info", "warn", "critical"], default="info", help='Enable debugging output to screen')
     #creds.add_argument('--filter', choices=["node", "tenant", "none"], default="none", help='Specify what to filter on. Default = none')
     creds.add_argument('--check', choices=["EPG_VXLAN_ENCAP", "BD_VXLAN_ENCAP", "VZANY_MISSING", "EPG_ENCAP_MISSING", "EPG_BD_MAPPING", "ALL"], default="all", help='Specify which checks to perform. Default = all')
+    creds.add_argument('--since-last', dest="since_last", action='store_true', help='Only report findings that are new, resolved or persisting since the previous run')
+    creds.add_argument('--findings-file', dest="findings_file", default=findings_filename, help='File used to store the findings of each run. Default = {}'.format(findings_filename))
     args = creds.get()
 
     # Set up custom logger
@@ -1252,6 +1361,14 @@ def main():
     #    print ("Debugging is enabled...")
     logger.debug("Debugging is enabled...")
 
+    # Load the findings of the previous run before they are overwritten by this run
+    previous_findings = load_findings(args.findings_file)
+
+    # With --since-last only the findings diff is of interest, so hide the detailed report unless debugging
+    logging_level = logger.level
+    if args.since_last and args.debug != "debug":
+        logger.setLevel(logging.WARNING)
+
     if args.check == "EPG_VXLAN_ENCAP":
         EPG_VXLAN_ENCAP(session)
     elif args.check == "BD_VXLAN_ENCAP":
@@ -1268,6 +1385,20 @@ def main():
         #print ("Something went wrong with the choices you've selected")
         logger.warning("Something went wrong with the choices you've selected")
 
+    # Restore the logging level selected on the command line
+    logger.setLevel(logging_level)
+
+    # Determine which checks were executed, so only their findings are compared and replaced in the findings file
+    if args.check == "ALL":
+        checks_run = all_checks
+    else:
+        checks_run = [check for check in all_checks if check == args.check]
+
+    if args.since_last:
+        report_findings_diff(previous_findings, checks_run)
+
+    write_findings(args.findings_file, checks_run, previous_findings)
+
     logger.info("\n")
     if args.log:
         #print ("#" * 80)
@@ -13,28 +13,115 @@ Michael Petrinovic 2018
 import acitoolkit.acitoolkit as aci
 from operator import itemgetter
 from tabulate import tabulate
+from multiprocessing.pool import ThreadPool
+import json
+import os
+import re
+import sqlite3
 import time
+import urllib
 
-def query_fault(handle, sev, sort):
+fault_state_filename = "aci_faults_state.json" # Default local fault table used by --poll, so polling can continue across runs
+fault_history_filename = "aci_faults_history.db" # Default local SQLite fault history store, used by --history-sync / --history
+fault_fields = ["code", "severity", "descr", "cause", "occur", "lastTransition"] # faultInst attributes kept in the local fault table
+
+def query_pages(handle, my_url, page_size):
+    '''
+    Custom function to perform a paginated class query, returning each page of objects as it is received
+    '''
+    page = 0
+    while True:
+        # URL for the class lookup, with the page variables
+        page_url = my_url + '&page-size=%s&page=%s' % (page_size, page)
+
+        #print("\nAPI Call to URL:")
+        #print(page_url + "\n")
+
+        ret = handle.get(page_url)
+        response = ret.json()
+        yield response['imdata']
+
+        page += 1
+        if len(response['imdata']) < page_size or page * page_size >= int(response['totalCount']):
+            break
+
+
+def query_faults(handle, sort, page_size, query_filter=None):
     '''
-    Custom function to return the set of faultInst objects that match the severity
+    Custom function to return all faultInst objects, using a single paginated class query for every severity.
+    Each page is returned as it is received. Optionally only return the faultInst objects that match the filter
     '''
-    # /api/node/class/faultInst.xml?query-target-filter=and(eq(faultInst.severity,"minor"))
+    # /api/node/class/faultInst.json?order-by=faultInst.lastTransition|desc&page-size=10000&page=0
     base_url = '/api/node/class/faultInst.json?'
 
     # Sort by last Transition time. Either Ascending or Descending order
     sort_order = 'order-by=faultInst.lastTransition|%s' % (sort) # asc | desc
 
-    # URL for a faultInst lookup, with severity variable
-    query_target_filter = '&query-target-filter=and(eq(faultInst.severity,"%s"))' % (sev)
-    my_url = base_url + sort_order + query_target_filter
+    my_url = base_url + sort_order
+    if query_filter:
+        my_url += '&query-target-filter=' + query_filter
+
+    return query_pages(handle, my_url, page_size)
 
-    #print("\nAPI Call to URL:")
-    #print(my_url + "\n")
+
+def query_fault_records(handle, page_size, since, ind=None):
+    '''
+    Custom function to return the faultRecord objects (fault history) created at or after the "since" timestamp, oldest first.
+    Optionally only return the records for one type of transition. Eg: ind = deletion
+    '''
+    # /api/node/class/faultRecord.json?order-by=faultRecord.created|asc&query-target-filter=ge(faultRecord.created,"2019-04-08T22:24:22")
+    my_url = '/api/node/class/faultRecord.json?order-by=faultRecord.created|asc'
+    query_filters = []
+    if since:
+        # URL encoded, as the + of the timezone offset would otherwise be decoded as a space
+        query_filters.append('ge(faultRecord.created,"%s")' % (urllib.quote(since, safe='')))
+    if ind:
+        query_filters.append('eq(faultRecord.ind,"%s")' % (ind))
+
+    if len(query_filters) == 1:
+        my_url += '&query-target-filter=' + query_filters[0]
+    elif len(query_filters) > 1:
+        my_url += '&query-target-filter=and(' + ','.join(query_filters) + ')'
+
+    return query_pages(handle, my_url, page_size)
+
+
+def query_fault_count(handle, query_filter):
+    '''
+    Custom function to return the number of faultInst objects that match the filter, without transferring the faults themselves
+    '''
+    # /api/node/class/faultInst.json?rsp-subtree-include=count&query-target-filter=eq(faultInst.severity,"minor")
+    my_url = '/api/node/class/faultInst.json?rsp-subtree-include=count'
+    if query_filter:
+        my_url += '&query-target-filter=' + query_filter
 
     ret = handle.get(my_url)
     response = ret.json()
-    return response
+    return int(response['imdata'][0]['moCount']['attributes']['count'])
+
+
+def query_fault_summary(handle, fault_severity, codes, per_node, workers):
+    '''
+    Custom function to return the fault counts per severity, and optionally per fault code and per node.
+    All the count queries are executed in parallel
+    '''
+    count_queries = [("Severity", sev, 'eq(faultInst.severity,"%s")' % (sev)) for sev in fault_severity]
+    count_queries += [("Code", code, 'eq(faultInst.code,"%s")' % (code)) for code in codes]
+
+    if per_node:
+        ret = handle.get('/api/node/class/fabricNode.json')
+        for node in ret.json()['imdata']:
+            node_dn = node["fabricNode"]["attributes"]["dn"] # topology/pod-1/node-101
+            count_queries.append(("Node", node_dn, 'wcard(faultInst.dn,"%s/")' % (node_dn)))
+
+    pool = ThreadPool(max(1, min(workers, len(count_queries))))
+    try:
+        counts = pool.map(lambda count_query: query_fault_count(handle, count_query[2]), count_queries)
+    finally:
+        pool.close()
+
+    return [(category, name, count) for (category, name, query_filter), count in zip(count_queries, counts)]
+
 
 def print_fault(severity, mo_list):
     '''
@@ -55,50 +142,123 @@ def print_fault(severity, mo_list):
         print ("N/A")
 
 
-def main():
+def split_dn(dn):
     '''
-    Main Routine
+    Split a DN into its RNs, ignoring any "/" within square brackets. Eg: topology/pod-1/node-101/sys/phys-[eth1/1]
     '''
-    # Take login credentials from the command line if provided
-    description = ('Simple application to display details about faults in an ACI Fabric')
-    creds = aci.Credentials('apic', description)
-    creds.add_argument('--sort', choices=["asc", "desc"], default="desc", help='Specify the sort order within each severity based on time/date. Default is Descending order. i.e. Newest faults at the top of each category')
+    rns = []
+    current = ""
+    depth = 0
+    for char in dn:
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == "/" and depth == 0:
+            rns.append(current)
+            current = ""
+            continue
+        current += char
+    rns.append(current)
+    return rns
 
-    args = creds.get()
 
-    # Login to APIC
-    session = aci.Session(args.url, args.login, args.password)
-    resp = session.login()
-    if not resp.ok:
-        print('%% Could not login to APIC')
-        return
+def aggregate_faults(pages, group_depth):
+    '''
+    Build a DN prefix trie of the affected objects for each severity / fault code, in a single pass over the faults
 
-    # Start time count at this point, otherwise takes into consideration the amount of time taken to input the password
-    start_time = time.time()
+    Each trie node holds the number of faults in that subtree and a few example DNs. The trie is only built down to the
+    grouping depth (eg: pod -> node for topology/..., tenant -> app profile -> EPG for uni/...), so its size is
+    bounded by the number of distinct problems rather than the number of fault instances
+    '''
+    fault_tries = {}
+    for mo_list in pages:
+        for entry in mo_list:
+            attributes = entry["faultInst"]["attributes"]
+            key = (attributes["severity"], attributes["code"])
+            if key not in fault_tries:
+                fault_tries[key] = {"count": 0, "children": {}, "examples": [], "cause": attributes["cause"]}
 
-    # Available severity codes for ACI Fault Instances
-    fault_severity = ["critical", "major", "minor", "warning", "info", "cleared"]
+            # The faultInst DN is the affected object DN followed by /fault-<code>
+            affected_rns = split_dn(attributes["dn"])[:-1]
+            depth = group_depth.get(affected_rns[0], group_depth["default"])
+
+            trie_node = fault_tries[key]
+            trie_node["count"] += 1
+            for rn in affected_rns[:depth]:
+                if rn not in trie_node["children"]:
+                    trie_node["children"][rn] = {"count": 0, "children": {}, "examples": []}
+                trie_node = trie_node["children"][rn]
+                trie_node["count"] += 1
+
+            if len(trie_node["examples"]) < 2:
+                trie_node["examples"].append("/".join(affected_rns))
+
+    return fault_tries
+
+
+def collect_fault_groups(trie_node, prefix):
+    '''
+    Walk a fault trie and return one row per grouping node: (subtree DN, count, example DNs)
+    '''
+    if len(trie_node["children"]) == 0:
+        return [(prefix, trie_node["count"], trie_node["examples"])]
+
+    groups = []
+    for rn, child in trie_node["children"].iteritems():
+        groups += collect_fault_groups(child, prefix + "/" + rn if prefix else rn)
+
+    # Faults on the object at this level itself, rather than on one of its children
+    remainder = trie_node["count"] - sum(child["count"] for child in trie_node["children"].itervalues())
+    if remainder > 0 and prefix:
+        groups.append((prefix, remainder, trie_node["examples"]))
+    return groups
+
+
+def print_fault_aggregation(fault_severity, fault_tries):
+    '''
+    Custom function to print the faults collapsed per severity / fault code / affected object subtree
+    '''
+    for severity in fault_severity:
+        codes = sorted((key for key in fault_tries if key[0] == severity), key=lambda key: -fault_tries[key]["count"])
+        print "=" * 80
+        print ("[" + severity + "] Faults Aggregated. Total = " + str(sum(fault_tries[key]["count"] for key in codes)))
+        print "=" * 80
+
+        if len(codes) == 0:
+            print ("N/A")
+            continue
 
-    fault_lookup = {} # Dictionary to be used to store the returned MO's, with the key being the severity
+        for key in codes:
+            print ("# [" + key[1] + "] Total = " + str(fault_tries[key]["count"]) + " [Cause: " + fault_tries[key]["cause"] + "]")
+            groups = sorted(collect_fault_groups(fault_tries[key], ""), key=lambda group: (-group[1], group[0]))
+            for subtree, count, examples in groups:
+                print ("    " + str(count).rjust(6) + " x " + subtree + "    [Eg: " + ", ".join(examples) + "]")
+
+
+def print_all_faults(session, fault_severity, args):
+    '''
+    Download every faultInst object, print them per severity and then print the summary of total faults
+    '''
+    fault_lookup = dict((fault_type, []) for fault_type in fault_severity) # Dictionary to be used to store the returned MO's, with the key being the severity
     fault_severity_count = {} # Dictionary to track total faults per severity
 
-    # Loop through all fault severity types, perform a fault lookup in the system and return the list of MO's.
-    # Assign to the fault_lookup dictionary, with severity as the key
-    for fault_type in fault_severity:
-        resp = query_fault(session, fault_type, args.sort)
-        resp2 = resp['imdata']
-        faultInst = []
+    # Perform a single fault lookup in the system for all severities, and partition the returned MO's by severity in one pass.
+    # As the query is already ordered by lastTransition, each severity list keeps that order
+    for resp2 in query_faults(session, args.sort, args.page_size):
         for entry in resp2:
-            faultInst.append((entry["faultInst"]["attributes"]["code"],
-                              entry["faultInst"]["attributes"]["descr"],
-                              entry["faultInst"]["attributes"]["cause"],
-                              entry["faultInst"]["attributes"]["occur"],
-                              entry["faultInst"]["attributes"]["lastTransition"]))
-
-        #print faultInst
-        fault_lookup[fault_type] = faultInst
-        # Find out the length of the inner list, based off the fault severity in the lookup
-        # eg: fault_lookup["critical"] = [x,y,z]
+            fault_type = entry["faultInst"]["attributes"]["severity"]
+            if fault_type not in fault_lookup:
+                continue
+            fault_lookup[fault_type].append((entry["faultInst"]["attributes"]["code"],
+                                             entry["faultInst"]["attributes"]["descr"],
+                                             entry["faultInst"]["attributes"]["cause"],
+                                             entry["faultInst"]["attributes"]["occur"],
+                                             entry["faultInst"]["attributes"]["lastTransition"]))
+
+    # Find out the length of the inner list, based off the fault severity in the lookup
+    # eg: fault_lookup["critical"] = [x,y,z]
+    for fault_type in fault_severity:
         fault_severity_count[fault_type] = len(fault_lookup[fault_type])
 
     # Loop through each severity, sort by faultCode and then print it out
@@ -112,6 +272,441 @@ def main():
         print (fault_summary + " = " + str(fault_severity_count[fault_summary]))
     print "=" * 80
 
+
+def load_fault_state(my_file):
+    '''
+    Read the local fault table and lastTransition high watermark saved by a previous poll
+    '''
+    if not os.path.isfile(my_file):
+        return {"high_watermark": "", "faults": {}}
+
+    with open(my_file) as json_file:
+        return json.load(json_file)
+
+
+def write_fault_state(my_file, fault_state):
+    '''
+    Save the local fault table and lastTransition high watermark for the next poll
+    '''
+    with open(my_file, 'w') as outfile:
+        json.dump(fault_state, outfile, separators=(',', ':'))
+
+
+def apply_fault_changes(fault_state, mo_list):
+    '''
+    Apply the returned faultInst objects to the local fault table, and move the high watermark forward
+
+    Returns the list of deltas as tuples: (change, dn, fault record)
+    '''
+    deltas = []
+    fault_table = fault_state["faults"]
+
+    for entry in mo_list:
+        attributes = entry["faultInst"]["attributes"]
+        fault_dn = attributes["dn"]
+        record = dict((field, attributes[field]) for field in fault_fields)
+        previous = fault_table.get(fault_dn)
+
+        if previous is None:
+            if record["severity"] != "cleared":
+                deltas.append(("RAISED", fault_dn, record))
+        elif record["severity"] == "cleared" and previous["severity"] != "cleared":
+            deltas.append(("CLEARED", fault_dn, record))
+        elif record != previous:
+            deltas.append(("CHANGED", fault_dn, record))
+
+        fault_table[fault_dn] = record
+        fault_state["high_watermark"] = max(fault_state["high_watermark"], record["lastTransition"])
+
+    return deltas
+
+
+def poll_faults(handle, fault_state, page_size):
+    '''
+    Fetch only the faults that changed since the lastTransition high watermark and update the local fault table
+
+    Faults that are deleted by the APIC never show up in the incremental query. Each deletion leaves a faultRecord with
+    ind = deletion, so those created since the same high watermark are fetched to remove the faults. Returns the list of deltas
+    '''
+    high_watermark = fault_state["high_watermark"]
+    fault_table = fault_state["faults"]
+
+    # ge rather than gt, so faults with the same timestamp as the high watermark are not missed. Unchanged faults produce no delta
+    deltas = []
+    # The timestamp is URL encoded, otherwise the + of the timezone offset is decoded as a space. Eg: 2019-04-08T22:24:22.123+10:00
+    for mo_list in query_faults(handle, "asc", page_size, 'ge(faultInst.lastTransition,"%s")' % (urllib.quote(high_watermark, safe=''))):
+        deltas += apply_fault_changes(fault_state, mo_list)
+
+    # Queried after the faults, with the previous high watermark, so a deletion between the two queries is not missed either
+    for mo_list in query_fault_records(handle, page_size, high_watermark, "deletion"):
+        for entry in mo_list:
+            attributes = entry["faultRecord"]["attributes"]
+            # The faultInst DN is the affected object DN plus the fault code. Eg: topology/pod-1/node-101/sys/phys-[eth1/1]/fault-F0532
+            fault_dn = attributes["affected"] + "/fault-" + attributes["code"]
+            record = fault_table.get(fault_dn)
+
+            # A fault raised again after it was deleted has a later lastTransition, and is kept
+            if record is None or record["lastTransition"] > attributes["created"]:
+                continue
+            del fault_table[fault_dn]
+            if record["severity"] != "cleared":
+                deltas.append(("CLEARED", fault_dn, record))
+
+    return deltas
+
+
+def print_fault_deltas(deltas):
+    '''
+    Custom function to print the raised / cleared / changed faults found during a poll
+    '''
+    for change, fault_dn, mo in deltas:
+        print ("# [" + change + "] [" + mo["severity"] + "] [" + mo["code"] + "] [Last Transition: " + mo["lastTransition"] + "] [DN: " + fault_dn + "] [Description = " + mo["descr"] + "]")
+
+
+def follow_faults(session, args):
+    '''
+    Poll the APIC every interval for the faults that changed, and print the deltas. Stop with Ctrl+C
+    '''
+    fault_state = load_fault_state(args.state_file)
+
+    if fault_state["high_watermark"] == "":
+        # No previous poll, so perform an initial full sync without printing every fault as raised
+        for mo_list in query_faults(session, "asc", args.page_size):
+            apply_fault_changes(fault_state, mo_list)
+        write_fault_state(args.state_file, fault_state)
+        print ("Initial sync completed. Faults = " + str(len(fault_state["faults"])) + ". High watermark = " + fault_state["high_watermark"])
+
+    while True:
+        previous = (fault_state["high_watermark"], len(fault_state["faults"]))
+        deltas = poll_faults(session, fault_state, args.page_size)
+        # Only rewrite the state file when the poll changed the fault table, so a quiet poll costs no more than its queries.
+        # A cleared fault that is deleted produces no delta, but does change the number of faults
+        if len(deltas) >= 1 or previous != (fault_state["high_watermark"], len(fault_state["faults"])):
+            write_fault_state(args.state_file, fault_state)
+
+        print ("=" * 80)
+        print ("[" + time.strftime("%Y-%m-%dT%H:%M:%S") + "] Raised = " + str(len([d for d in deltas if d[0] == "RAISED"])) +
+               ", Cleared = " + str(len([d for d in deltas if d[0] == "CLEARED"])) +
+               ", Changed = " + str(len([d for d in deltas if d[0] == "CHANGED"])) +
+               ". Total faults = " + str(len(fault_state["faults"])))
+        print_fault_deltas(deltas)
+
+        time.sleep(args.poll)
+
+
+def apply_fault_event(fault_table, severity_index, attributes):
+    '''
+    Apply a single faultInst creation / modification / deletion to the in-memory fault table and its severity index.
+    Modification events only contain the changed attributes, so they are merged into the existing record
+
+    Returns the delta as a tuple: (change, dn, fault record), or None if nothing changed
+    '''
+    fault_dn = attributes["dn"]
+    previous = fault_table.get(fault_dn)
+
+    if attributes.get("status") == "deleted":
+        if previous is None:
+            return None
+        del fault_table[fault_dn]
+        severity_index[previous["severity"]].discard(fault_dn)
+        return ("DELETED", fault_dn, previous)
+
+    if previous is None:
+        record = dict((field, "") for field in fault_fields)
+    else:
+        record = dict(previous)
+        severity_index[previous["severity"]].discard(fault_dn)
+    record.update((field, attributes[field]) for field in fault_fields if field in attributes)
+
+    fault_table[fault_dn] = record
+    severity_index.setdefault(record["severity"], set()).add(fault_dn)
+
+    if previous is None:
+        return ("RAISED", fault_dn, record)
+    elif record["severity"] == "cleared" and previous["severity"] != "cleared":
+        return ("CLEARED", fault_dn, record)
+    elif record != previous:
+        return ("CHANGED", fault_dn, record)
+    return None
+
+
+def resync_faults(session, page_size, fault_table, severity_index):
+    '''
+    Bring the in-memory fault table in line with a paginated snapshot query. Returns the list of deltas
+    '''
+    deltas = []
+    current_faults = set()
+
+    for mo_list in query_faults(session, "asc", page_size):
+        for entry in mo_list:
+            attributes = entry["faultInst"]["attributes"]
+            current_faults.add(attributes["dn"])
+            deltas.append(apply_fault_event(fault_table, severity_index, attributes))
+
+    for fault_dn in list(fault_table):
+        if fault_dn not in current_faults:
+            deltas.append(apply_fault_event(fault_table, severity_index, {"dn": fault_dn, "status": "deleted"}))
+
+    return [delta for delta in deltas if delta is not None]
+
+
+def get_subscription_marker(session, subscription_url):
+    '''
+    Return the subscription ID and websocket currently used for the URL, or None if they cannot be read.
+
+    After a failed subscription refresh or a re-login the ACI Toolkit silently resubscribes with only_new=True, and it reopens
+    the websocket if it has dropped. Either way the events in between are lost, which shows up as a change of this marker
+    '''
+    subscriber = getattr(session, "subscription_thread", None)
+    if subscriber is None:
+        return None
+    return (subscriber._subscriptions.get(subscription_url), getattr(subscriber, "_ws", None))
+
+
+def is_fault_table_current(session, fault_table):
+    '''
+    Compare the in-memory fault table with a count query and the newest faultInst lastTransition on the APIC.
+    Catches events that were missed in a way the subscription marker did not show
+    '''
+    if query_fault_count(session, None) != len(fault_table):
+        return False
+
+    newest_transition = ""
+    for mo_list in query_faults(session, "desc", 1):
+        if len(mo_list) >= 1:
+            newest_transition = mo_list[0]["faultInst"]["attributes"]["lastTransition"]
+        break
+    return newest_transition <= max([record["lastTransition"] for record in fault_table.values()] or [""])
+
+
+def follow_fault_events(session, fault_severity, args):
+    '''
+    Subscribe to faultInst creation / modification / deletion events and print each change as it arrives. Stop with Ctrl+C
+
+    A paginated snapshot query is only performed at start up, and again if the subscription drops, is silently renewed,
+    or the periodic count and lastTransition check shows that the fault table is out of sync
+    '''
+    subscription_url = '/api/class/faultInst.json?subscription=yes'
+    fault_table = {} # Fault DN to fault record
+    severity_index = {} # Severity to the set of fault DNs with that severity
+
+    # Subscribe before taking the snapshot, so no change is missed in between
+    session.subscribe(subscription_url, only_new=True)
+    subscription_marker = get_subscription_marker(session, subscription_url)
+    resync_faults(session, args.page_size, fault_table, severity_index)
+    last_check = time.time()
+    print ("Following faults. " + ", ".join(sev + " = " + str(len(severity_index.get(sev, ()))) for sev in fault_severity))
+
+    while True:
+        deltas = []
+        resync_reason = None
+        if not session.is_subscribed(subscription_url):
+            print ("%% Subscription dropped. Resubscribing")
+            session.subscribe(subscription_url, only_new=True)
+            resync_reason = "subscription dropped"
+
+        while session.has_events(subscription_url):
+            event = session.get_event(subscription_url)
+            for entry in event["imdata"]:
+                if "faultInst" in entry:
+                    deltas.append(apply_fault_event(fault_table, severity_index, entry["faultInst"]["attributes"]))
+
+        if get_subscription_marker(session, subscription_url) != subscription_marker:
+            resync_reason = resync_reason or "subscription renewed"
+        elif time.time() - last_check >= args.check_interval:
+            last_check = time.time()
+            if not is_fault_table_current(session, fault_table):
+                resync_reason = "fault count / lastTransition mismatch"
+
+        if resync_reason:
+            print ("%% Resyncing from a snapshot query: " + resync_reason)
+            subscription_marker = get_subscription_marker(session, subscription_url)
+            deltas += resync_faults(session, args.page_size, fault_table, severity_index)
+            last_check = time.time()
+
+        deltas = [delta for delta in deltas if delta is not None]
+        if len(deltas) >= 1:
+            print ("=" * 80)
+            print ("[" + time.strftime("%Y-%m-%dT%H:%M:%S") + "] " + ", ".join(sev + " = " + str(len(severity_index.get(sev, ()))) for sev in fault_severity))
+            print_fault_deltas(deltas)
+
+        time.sleep(0.1)
+
+
+def open_fault_history(my_file):
+    '''
+    Open the local fault history store, creating the table and indexes on first use
+    '''
+    db = sqlite3.connect(my_file)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS fault_history (
+            record_id TEXT PRIMARY KEY, -- faultRecord id, so the same record is never stored twice
+            created TEXT,
+            code TEXT,
+            severity TEXT,
+            node TEXT,
+            affected TEXT,
+            ind TEXT,
+            lc TEXT,
+            cause TEXT,
+            descr TEXT
+        );
+        CREATE INDEX IF NOT EXISTS fault_history_created ON fault_history (created);
+        CREATE INDEX IF NOT EXISTS fault_history_code ON fault_history (code, created);
+        CREATE INDEX IF NOT EXISTS fault_history_severity ON fault_history (severity, created);
+        CREATE INDEX IF NOT EXISTS fault_history_affected ON fault_history (affected, created);
+        CREATE INDEX IF NOT EXISTS fault_history_node ON fault_history (node, code, created);
+    ''')
+    return db
+
+
+def sync_fault_history(handle, db, page_size):
+    '''
+    Ingest the faultRecord objects created since the newest record already in the local fault history store.
+    Every faultInst transition (raised / changed / cleared) creates a faultRecord, so this covers both
+
+    Returns the number of new records stored
+    '''
+    since = db.execute('SELECT MAX(created) FROM fault_history').fetchone()[0]
+    changes_before = db.total_changes
+
+    for mo_list in query_fault_records(handle, page_size, since):
+        records = []
+        for entry in mo_list:
+            attributes = entry["faultRecord"]["attributes"]
+            node = re.search('/node-([0-9]+)', attributes["affected"])
+            records.append((attributes["id"], attributes["created"], attributes["code"], attributes["severity"],
+                            node.group(1) if node else "", attributes["affected"], attributes["ind"], attributes["lc"],
+                            attributes["cause"], attributes["descr"]))
+
+        # Records with the same timestamp as the newest stored record are returned again, and simply ignored
+        db.executemany('INSERT OR IGNORE INTO fault_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+        db.commit()
+
+    return db.total_changes - changes_before
+
+
+def query_fault_history(db, args):
+    '''
+    Answer the history query from the local fault history store, without touching the APIC
+
+    Returns the total number of matching records, and the top N code / affected object pairs by number of records
+    '''
+    where = []
+    params = []
+    if args.code:
+        where.append('code = ?')
+        params.append(args.code)
+    if args.severity:
+        where.append('severity = ?')
+        params.append(args.severity)
+    if args.node:
+        where.append('node = ?')
+        params.append(args.node)
+    if args.affected:
+        # Prefix match expressed as a range, so the affected index can be used. Eg: topology/pod-1/node-203/sys/phys-[eth1/1]
+        where.append('affected >= ? AND affected < ?')
+        params += [args.affected, args.affected + u'\uffff']
+    if args.start:
+        where.append('created >= ?')
+        params.append(args.start)
+    if args.end:
+        where.append('created <= ?')
+        params.append(args.end)
+
+    where_clause = ''
+    if len(where) >= 1:
+        where_clause = ' WHERE ' + ' AND '.join(where)
+
+    total = db.execute('SELECT COUNT(*) FROM fault_history' + where_clause, params).fetchone()[0]
+    top = db.execute("SELECT code, node, affected, COUNT(*), SUM(severity = 'cleared'), MIN(created), MAX(created) FROM fault_history" +
+                     where_clause + " GROUP BY code, affected ORDER BY COUNT(*) DESC LIMIT ?", params + [args.top]).fetchall()
+    return total, top
+
+
+def main():
+    '''
+    Main Routine
+    '''
+    # Take login credentials from the command line if provided
+    description = ('Simple application to display details about faults in an ACI Fabric')
+    creds = aci.Credentials('apic', description)
+    creds.add_argument('--sort', choices=["asc", "desc"], default="desc", help='Specify the sort order within each severity based on time/date. Default is Descending order. i.e. Newest faults at the top of each category')
+    creds.add_argument('--summary-only', dest="summary_only", action='store_true', help='Only print the summary of total faults, using count queries without downloading the faults')
+    creds.add_argument('--summary-codes', dest="summary_codes", nargs='+', default=[], help='With --summary-only, also count the faults for each of these fault codes. Eg: F0467 F1394')
+    creds.add_argument('--summary-nodes', dest="summary_nodes", action='store_true', help='With --summary-only, also count the faults for each node')
+    creds.add_argument('--workers', type=int, default=8, help='Number of count queries executed in parallel with --summary-only. Default = 8')
+    creds.add_argument('--poll', type=int, help='Poll for the faults raised / cleared / changed every POLL seconds, only fetching the faults changed since the last poll')
+    creds.add_argument('--state-file', dest="state_file", default=fault_state_filename, help='Local fault table used by --poll. Default = {}'.format(fault_state_filename))
+    creds.add_argument('--follow', action='store_true', help='Subscribe to fault events and print the faults raised / cleared / changed / deleted as they happen')
+    creds.add_argument('--check-interval', dest="check_interval", type=int, default=300, help='With --follow, compare the fault count and newest lastTransition with the APIC every CHECK_INTERVAL seconds, and resync if they differ. Default = 300')
+    creds.add_argument('--aggregate', action='store_true', help='Collapse the faults per fault code and affected object subtree (pod -> node, or tenant -> app profile -> EPG) instead of one line per fault')
+    creds.add_argument('--aggregate-depth', dest="aggregate_depth", type=int, help='Override the number of DN levels used to group the affected objects. Eg: 4 = topology/pod-1/node-101/sys')
+    # --history never logs in to the APIC, so it cannot be combined with a sync
+    history_mode = creds.add_mutually_exclusive_group()
+    history_mode.add_argument('--history-sync', dest="history_sync", action='store_true', help='Store the fault records created since the last sync in the local fault history store')
+    history_mode.add_argument('--history', action='store_true', help='Query the local fault history store, without logging in to the APIC. Use with --code / --severity / --node / --affected / --start / --end / --top')
+    creds.add_argument('--history-db', dest="history_db", default=fault_history_filename, help='Local fault history store. Default = {}'.format(fault_history_filename))
+    creds.add_argument('--code', help='With --history, only records for this fault code. Eg: F0467')
+    creds.add_argument('--severity', choices=["critical", "major", "minor", "warning", "info", "cleared"], help='With --history, only records with this severity')
+    creds.add_argument('--node', help='With --history, only records for this node ID. Eg: 203')
+    creds.add_argument('--affected', help='With --history, only records where the affected object DN starts with this. Eg: topology/pod-1/node-203/sys/phys-[eth1/1]')
+    creds.add_argument('--start', help='With --history, only records created from this Date/Time. Full Format: 2018-02-23T08:14:25')
+    creds.add_argument('--end', help='With --history, only records created until this Date/Time. Full Format: 2018-02-23T08:14:25')
+    creds.add_argument('--top', type=int, default=20, help='With --history, number of code / affected object pairs to display. Default = 20')
+    creds.add_argument('--page-size', dest="page_size", type=int, default=10000, help='Number of faults retrieved per faultInst query. Default = 10000')
+
+    args = creds.get()
+
+    # Login to APIC only if NOT querying the local fault history store - as already have the data we need locally
+    if not args.history:
+        session = aci.Session(args.url, args.login, args.password)
+        resp = session.login()
+        if not resp.ok:
+            print('%% Could not login to APIC')
+            return
+
+    # Start time count at this point, otherwise takes into consideration the amount of time taken to input the password
+    start_time = time.time()
+
+    # Available severity codes for ACI Fault Instances
+    fault_severity = ["critical", "major", "minor", "warning", "info", "cleared"]
+
+    if args.history_sync:
+        db = open_fault_history(args.history_db)
+        new_records = sync_fault_history(session, db, args.page_size)
+        print ("Fault history records stored: " + str(new_records) + ". Total records = " + str(db.execute('SELECT COUNT(*) FROM fault_history').fetchone()[0]))
+        db.close()
+    elif args.history:
+        db = open_fault_history(args.history_db)
+        total, top = query_fault_history(db, args)
+        db.close()
+        print "=" * 80
+        print ("Fault history records matching = " + str(total))
+        print "=" * 80
+        print (tabulate(top, headers=["Code", "Node", "Affected", "Records", "Cleared", "First", "Last"], tablefmt="simple"))
+    elif args.follow:
+        follow_fault_events(session, fault_severity, args)
+    elif args.poll:
+        follow_faults(session, args)
+    elif args.aggregate:
+        # Number of DN levels to group the affected objects on. topology/pod-1/node-101 or uni/tn-mipetrin/ap-App/epg-Web
+        group_depth = {"topology": 3, "uni": 4, "default": 2}
+        if args.aggregate_depth:
+            group_depth = {"default": args.aggregate_depth}
+        fault_tries = aggregate_faults(query_faults(session, args.sort, args.page_size), group_depth)
+        print_fault_aggregation(fault_severity, fault_tries)
+    elif args.summary_only:
+        # Only the counts are required, so avoid transferring and formatting every faultInst object
+        print "=" * 80
+        print ("Summary of total faults")
+        print "-" * 80
+        fault_summary = query_fault_summary(session, fault_severity, args.summary_codes, args.summary_nodes, args.workers)
+        print (tabulate(fault_summary, headers=["Category", "Name", "Total"], tablefmt="simple"))
+        print "=" * 80
+    else:
+        print_all_faults(session, fault_severity, args)
+
     print ("#" * 80)
     finish_time = time.time()
     print ("Started @ {}".format(time.asctime(time.localtime(start_time))))
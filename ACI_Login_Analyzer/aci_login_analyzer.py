@@ -4,67 +4,274 @@ Simple script to allow user to
 
 Requires the ACI Toolkit: pip install acitoolkit
 
-To Do:
-    * Analyse data from aaaSessionLR
-        * see who is logging into the system, how many times.
-        * Count logins/logouts/refresh (trig). Look at the (descr) to get some more details.
+Detection (--detect):
     * If user is unknown and description contains Failure.
         * Means user has attempted to log in without a valid user on the system == worth to follow up
     * If user is defined/known and description contains Failure.
         * Means valid user but incorrect password. Could be a simple typo.
         * If, however, see many similar login attempts in short succession WITHOUT a successful login to break it up
         * FLAG, worth to follow up
+    * If the same source fails to log in as many different users in short succession
+        * Password spraying / credential stuffing, FLAG
     * If user is root, either successful or not
         * BE AFRAID unless working with TAC
 
+To Do:
+    * Analyse data from aaaSessionLR
+        * see who is logging into the system, how many times.
+        * Count logins/logouts/refresh (trig). Look at the (descr) to get some more details.
+
 Michael Petrinovic 2018
 """
 import acitoolkit.acitoolkit as aci
-from tabulate import tabulate
+from collections import Counter, deque
+from multiprocessing.pool import ThreadPool
+import calendar
 import re
+import sqlite3
 import time
+import urllib
 
-def main():
-    description = ('Simple application that logs on to the APIC and displays the AAA logs')
-    creds = aci.Credentials('apic', description)
-    creds.add_argument('--start', help='Start Date/Time for the search until either --end date/time or current date/time. Full Format: 2018-02-23T08:14:25')
-    creds.add_argument('--end', help='End Date/Time for the search until either --start date/time or the beginning of the records. Full Format: 2018-02-23T08:14:25')
-    creds.add_argument('--user', help='Find records for a specific user. Default is all. Use "UNKNOWN" to see unknown attempts. Can also look for "root"')
-    creds.add_argument('--action', choices=["login", "logout", "refresh"], help='Find records for this specific action. Default is all')
-    creds.add_argument('--result', choices=["Success", "Failure"], help='Specify an result to filter on. Default is all')
-    creds.add_argument('--sort', choices=["asc", "desc"], default="desc", help='Specify the sort order. Default is Descending. i.e. Newest logs at the top')
-    creds.add_argument('--debug', action='store_true', help='Print debug output')
-    args = creds.get()
+# Source address of a session, within the aaaSessionLR description
+source_pattern = re.compile(r'From-([0-9a-fA-F:.]+)-')
 
-    # Login to APIC
-    session = aci.Session(args.url, args.login, args.password)
-    resp = session.login()
-    if not resp.ok:
-        print('%% Could not login to APIC')
-        exit(0)
+login_archive_filename = "aci_login_archive.db"
 
-    # Start time count at this point, otherwise takes into consideration the amount of time taken to input the password
-    start_time = time.time()
 
+def query_pages(handle, my_url, page_size, workers=1):
+    '''
+    Custom function to perform a paginated class query, returning each page of records as it is received, in order
+    With more than 1 worker, the following pages are fetched in parallel, <workers> pages at a time
+    Returns the total number of matching records first, then each page
+    '''
+    def get_page(page):
+        # URL for the class lookup, with the page variables
+        ret = handle.get(my_url + '&page-size=%s&page=%s' % (page_size, page))
+        return ret.json()
+
+    response = get_page(0)
+    total_count = int(response['totalCount']) # Need to change to Int as returned in unicode
+    yield total_count
+    yield response['imdata']
+
+    total_pages = (total_count + page_size - 1) // page_size
+    if workers <= 1:
+        for page in xrange(1, total_pages):
+            imdata = get_page(page)['imdata']
+            if not imdata:
+                break
+            yield imdata
+    else:
+        pool = ThreadPool(workers)
+        try:
+            # Only <workers> pages are held in memory at any time
+            for first_page in xrange(1, total_pages, workers):
+                for response in pool.map(get_page, range(first_page, min(first_page + workers, total_pages))):
+                    yield response['imdata']
+        finally:
+            pool.close()
+
+
+def get_session_record(entry):
+    '''
+    Return the row to print for an aaaSessionLR entry
+    '''
+    # NOTE that the returned data is actually in Unicode format
+    attributes = entry["aaaSessionLR"]["attributes"]
+    result = "Success"
+    user = ""
+    # Search for Internal Relationship Objects that the APIC Automatically creates/deletes
+    # Hide these by default unless user wishes to see them as well
+    if re.search("Failure", attributes["descr"]):
+        result = "Failure"
+
+    if attributes["user"] == "":
+        # If APIC doesn't know the user, it returns a blank space, hence modifying to print UNKNOWN
+        user = "UNKNOWN"
+    else:
+        user = attributes["user"]
+
+    return (attributes["created"], attributes["id"], user, attributes["trig"], attributes["descr"], result)
+
+
+def print_session_rows(rows, print_headers):
+    '''
+    Print the aaaSessionLR rows in fixed width columns, so each page can be printed as soon as it is received
+
+    Users and descriptions can contain non-ASCII characters, so the rows are printed as UTF-8
+    '''
+    row_format = u"{:<29}  {:<20}  {:<20}  {:<8}  {:<60}  {}"
+    if print_headers:
+        print (row_format.format("Timestamp", "ID", "User", "Action", "Description", "Result").encode("utf-8"))
+        print (row_format.format("-" * 29, "-" * 20, "-" * 20, "-" * 8, "-" * 60, "-" * 7).encode("utf-8"))
+    for row in rows:
+        print (row_format.format(*row).encode("utf-8"))
+
+
+def get_timestamp(created):
+    '''
+    Convert the aaaSessionLR created time to seconds since the epoch. Eg: 2018-02-23T08:14:25.123+11:00
+    '''
+    # Sliced rather than time.strptime, as this is called for every record
+    timestamp = calendar.timegm((int(created[0:4]), int(created[5:7]), int(created[8:10]),
+                                 int(created[11:13]), int(created[14:16]), int(created[17:19])))
+    if created[-6] in "+-":
+        seconds = int(created[-5:-3]) * 3600 + int(created[-2:]) * 60
+        timestamp += -seconds if created[-6] == "+" else seconds
+
+    return timestamp
+
+
+def get_source(attributes):
+    '''
+    The source address of the session. Eg: descr = From-10.66.80.11-client-type-REST-Failure
+    '''
+    if attributes.get("remoteAddr"):
+        return attributes["remoteAddr"]
+
+    match = source_pattern.search(attributes["descr"])
+    return match.group(1) if match else "unknown"
+
+
+class LoginDetector(object):
+    '''
+    Streaming detection of suspicious logins. The aaaSessionLR records must be processed in time order
+    Keeps a sliding window (deque of timestamps) of the recent failures per user and per source, so each record is processed
+    in constant time and memory is bounded by the number of users/sources seen within the window
+    '''
+    def __init__(self, window, failure_threshold, unknown_threshold, spray_threshold):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.unknown_threshold = unknown_threshold
+        self.spray_threshold = spray_threshold
+        self.user_failures = {} # user -> deque of (timestamp, source) failures since the last successful login from that source
+        self.unknown_failures = {} # source -> deque of UNKNOWN user failure timestamps
+        self.source_failures = {} # source -> deque of (timestamp, user) failures of known users
+        self.source_users = {} # source -> Counter of the users within source_failures
+        self.records = 0
+        self.last_timestamp = 0
+
+    def expire(self, failures, now):
+        while failures and failures[0] < now - self.window:
+            failures.popleft()
+
+    def sweep(self, now):
+        '''
+        Forget the users/sources without any failure left in the window
+        '''
+        for user in [user for user, failures in self.user_failures.iteritems() if not failures or failures[-1][0] < now - self.window]:
+            del self.user_failures[user]
+        for source in [source for source, failures in self.unknown_failures.iteritems() if not failures or failures[-1] < now - self.window]:
+            del self.unknown_failures[source]
+        for source in [source for source, failures in self.source_failures.iteritems() if not failures or failures[-1][0] < now - self.window]:
+            del self.source_failures[source]
+            del self.source_users[source]
+
+    def process(self, attributes):
+        '''
+        Process a single aaaSessionLR record. Returns the list of alerts (timestamp, alert, user, source, details) it raised
+        '''
+        now = get_timestamp(attributes["created"])
+        user = attributes["user"] or "UNKNOWN"
+        source = get_source(attributes)
+        failure = "Failure" in attributes["descr"]
+        alerts = []
+
+        self.records += 1
+        self.last_timestamp = now
+        if self.records % 10000 == 0:
+            self.sweep(now)
+
+        if user == "root":
+            alerts.append((attributes["created"], "ROOT", user, source, "{} {}".format(attributes["trig"], "Failure" if failure else "Success")))
+
+        if not failure:
+            if attributes["trig"] == "login" and user in self.user_failures:
+                # A successful login only breaks up the failures of this user from the same source. A refresh / logout of an
+                # existing session (Eg: a GUI left open) must not hide a brute force against the same account from elsewhere
+                remaining = deque(entry for entry in self.user_failures[user] if entry[1] != source)
+                if remaining:
+                    self.user_failures[user] = remaining
+                else:
+                    del self.user_failures[user]
+            return alerts
+
+        if user == "UNKNOWN":
+            failures = self.unknown_failures.setdefault(source, deque())
+            failures.append(now)
+            self.expire(failures, now)
+            if len(failures) >= self.unknown_threshold:
+                alerts.append((attributes["created"], "UNKNOWN USER", user, source,
+                               "{} failures within {} seconds".format(len(failures), self.window)))
+                failures.clear()
+            return alerts
+
+        failures = self.user_failures.setdefault(user, deque())
+        failures.append((now, source))
+        while failures[0][0] < now - self.window:
+            failures.popleft()
+        if len(failures) >= self.failure_threshold:
+            alerts.append((attributes["created"], "BRUTE FORCE", user, source,
+                           "{} failures within {} seconds without a successful login".format(len(failures), self.window)))
+            failures.clear()
+
+        source_failures = self.source_failures.setdefault(source, deque())
+        source_users = self.source_users.setdefault(source, Counter())
+        source_failures.append((now, user))
+        source_users[user] += 1
+        while source_failures[0][0] < now - self.window:
+            expired_user = source_failures.popleft()[1]
+            source_users[expired_user] -= 1
+            if source_users[expired_user] == 0:
+                del source_users[expired_user]
+        if len(source_users) >= self.spray_threshold:
+            alerts.append((attributes["created"], "PASSWORD SPRAY", ", ".join(sorted(source_users)), source,
+                           "{} users failed within {} seconds".format(len(source_users), self.window)))
+            source_failures.clear()
+            source_users.clear()
+
+        return alerts
+
+
+def print_alerts(alerts, print_headers):
+    '''
+    Print the alerts in fixed width columns, as soon as they are raised. Printed as UTF-8, like the session rows
+    '''
+    row_format = u"{:<29}  {:<14}  {:<20}  {:<39}  {}"
+    if print_headers:
+        print (row_format.format("Timestamp", "Alert", "User", "Source", "Details").encode("utf-8"))
+        print (row_format.format("-" * 29, "-" * 14, "-" * 20, "-" * 39, "-" * 40).encode("utf-8"))
+    for alert in alerts:
+        print (row_format.format(*alert).encode("utf-8"))
+
+
+def build_query_url(args, sort, since=None):
+    '''
+    Build the aaaSessionLR class query, with the custom query-target-filter for the selected options
+    If since is set, it replaces --start and the records created at that exact time are included (ge rather than gt)
+    '''
     # ACI Query Target Filters:
     # https://www.cisco.com/c/en/us/td/docs/switches/datacenter/aci/apic/sw/2-x/rest_cfg/2_1_x/b_Cisco_APIC_REST_API_Configuration_Guide/b_Cisco_APIC_REST_API_Configuration_Guide_chapter_01.html
 
     base_url = '/api/node/class/aaaSessionLR.json?'
 
     # Sort by creation time. Either Ascending or Descending order
-    sort_order = 'order-by=aaaSessionLR.created|%s' % (args.sort) # asc | desc
+    sort_order = 'order-by=aaaSessionLR.created|%s' % (sort) # asc | desc
 
     # Build out the custom query-target-filter
     #if not (args.start and args.end and args.user and args.action and args.result) is None:
-    if (args.start is None) and (args.end is None) and (args.user is None) and (args.action is None) and (args.result is None):
-        print "\nNo custom filter selected\n"
+    if (since is None) and (args.start is None) and (args.end is None) and (args.user is None) and (args.exclude_user is None) and (args.action is None) and (args.result is None):
         my_url = base_url + sort_order
     else:
-        print "\nAt least one custom filter is selected\n"
         query_target_filter = '&query-target-filter=and('
         custom_filter = []
 
-        if not(args.start is None):
+        if not(since is None):
+            # Records sharing the timestamp of the last one processed, so they are returned again and de-duplicated by the caller
+            # URL encoded, as the + of the timezone offset would otherwise be decoded as a space
+            custom_filter.append('ge(aaaSessionLR.created,"%s")' % (urllib.quote(since, safe='')))
+            if args.debug: print custom_filter
+        elif not(args.start is None):
             # Meaning it is set
             custom_filter.append('gt(aaaSessionLR.created,"%s")' % (args.start))
             if args.debug: print custom_filter
@@ -76,19 +283,30 @@ def main():
 
         if not(args.user is None):
             # Meaning it is set
-            # Check if CLI arg user = UNKNOWN. If so, need to modify query to return
-            # everything, then filter on UNKNOWN during printing only
-            # This is because can't search on blank wildcard
+            # Check if CLI arg user = UNKNOWN. If so, match the blank user exactly, as can't search on blank wildcard
             if args.user == "UNKNOWN":
-                #custom_filter.append('wcard(aaaSessionLR.user, "")')
-                pass
+                custom_filter.append('eq(aaaSessionLR.user,"")')
+                if args.debug: print custom_filter
             else:
                 custom_filter.append('wcard(aaaSessionLR.user, "%s")' % (args.user))
                 if args.debug: print custom_filter
 
+        if not(args.exclude_user is None):
+            # Meaning it is set. Eg: Skip the automation service accounts
+            for exclude_user in args.exclude_user.split(","):
+                if exclude_user == "UNKNOWN":
+                    custom_filter.append('not(eq(aaaSessionLR.user,""))')
+                else:
+                    custom_filter.append('not(wcard(aaaSessionLR.user,"%s"))' % (exclude_user))
+            if args.debug: print custom_filter
+
         if not(args.result is None):
             # Meaning it is set
-            custom_filter.append('wcard(aaaSessionLR.descr,"%s")' % (args.result))
+            # Any record without Failure in the description is reported as a Success, so match the same records on the APIC
+            if args.result == "Failure":
+                custom_filter.append('wcard(aaaSessionLR.descr,"Failure")')
+            else:
+                custom_filter.append('not(wcard(aaaSessionLR.descr,"Failure"))')
             if args.debug: print custom_filter
 
         if not(args.action is None):
@@ -114,56 +332,280 @@ def main():
         query_target_filter += query_target_filter_end
         my_url = base_url + sort_order + query_target_filter
 
-    print("API Call to URL:")
-    print(my_url + "\n")
-    ret = session.get(my_url)
-    response = ret.json()
+    return my_url
 
-    total_count = int(response['totalCount']) # Need to change to Int as returned in unicode
-    imdata = response['imdata']
 
-    aaaSessionLR = [] # Put into a list that will be printed by Tabulate
+def detect(session, args):
+    '''
+    Run the login records through the detector, oldest first, printing the alerts as they are raised
+    With --watch, keep polling for the records created since the last one processed
+    '''
+    detector = LoginDetector(args.window, args.failure_threshold, args.unknown_threshold, args.spray_threshold)
+    alert_count = 0
+    last_created = None # Creation time of the last record processed
+    last_dns = set() # DNs of the records created at last_created that were already processed
+
+    try:
+        while True:
+            my_url = build_query_url(args, "asc", last_created)
+            if args.debug: print(my_url)
+
+            pages = query_pages(session, my_url, args.page_size, args.workers)
+            next(pages)
+            for imdata in pages:
+                for entry in imdata:
+                    attributes = entry["aaaSessionLR"]["attributes"]
+                    # Several records can share a timestamp, so the next poll asks for ge(last_created) and skips those already processed
+                    if attributes["created"] == last_created:
+                        if attributes["dn"] in last_dns:
+                            continue
+                    else:
+                        last_created = attributes["created"]
+                        last_dns = set()
+                    last_dns.add(attributes["dn"])
+
+                    alerts = detector.process(attributes)
+                    if alerts:
+                        print_alerts(alerts, alert_count == 0)
+                        alert_count += len(alerts)
+
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
+
+    print ("=" * 80)
+    print ("Total records processed: " + str(detector.records))
+    print ("Total alerts raised: " + str(alert_count))
+    print ("=" * 80)
+
+
+def print_records(session, my_url, args):
+    '''
+    Print every aaaSessionLR record returned by the query
+    '''
+    print("API Call to URL:")
+    print(my_url + "\n")
+    pages = query_pages(session, my_url, args.page_size, args.workers)
+    total_count = next(pages)
+    records_printed = 0
 
     if total_count == 0:
         print ("Query returned no results. Try modifying your filters\n")
     else:
-        # There is at least 1 result
+        # There is at least 1 result. Print each page of records as soon as it is received
+        for imdata in pages:
+            # Only the matching records are returned by the APIC, so every record of the page is printed
+            aaaSessionLR = [get_session_record(entry) for entry in imdata]
+            print_session_rows(aaaSessionLR, records_printed == 0)
+            records_printed += len(aaaSessionLR)
+
+        print ("=" * 80)
+        print ("Total records returned: " + str(records_printed))
+        print ("=" * 80)
+
+
+def open_login_archive(my_file):
+    '''
+    Open the local login record archive, creating the table and indexes on first use
+    '''
+    db = sqlite3.connect(my_file)
+    db.executescript('''
+        CREATE TABLE IF NOT EXISTS login_archive (
+            id TEXT PRIMARY KEY, -- aaaSessionLR id, so the same record is never stored twice
+            created TEXT,
+            user TEXT, -- Blank for UNKNOWN users, as returned by the APIC
+            trig TEXT,
+            result TEXT,
+            source TEXT,
+            descr TEXT
+        );
+        CREATE INDEX IF NOT EXISTS login_archive_created ON login_archive (created);
+        CREATE INDEX IF NOT EXISTS login_archive_user ON login_archive (user, created);
+        CREATE INDEX IF NOT EXISTS login_archive_trig ON login_archive (trig, created);
+        CREATE INDEX IF NOT EXISTS login_archive_result ON login_archive (result, created);
+    ''')
+    return db
+
+
+def sync_login_archive(handle, db, page_size, workers):
+    '''
+    Append the aaaSessionLR records created since the newest record already in the local archive (the high watermark)
+
+    Returns the number of new records stored
+    '''
+    my_url = '/api/node/class/aaaSessionLR.json?order-by=aaaSessionLR.created|asc'
+    since = db.execute('SELECT MAX(created) FROM login_archive').fetchone()[0]
+    if since:
+        # URL encoded, as the + of the timezone offset would otherwise be decoded as a space
+        my_url += '&query-target-filter=ge(aaaSessionLR.created,"%s")' % (urllib.quote(since, safe=''))
+    changes_before = db.total_changes
+
+    pages = query_pages(handle, my_url, page_size, workers)
+    next(pages)
+    for imdata in pages:
+        records = []
         for entry in imdata:
-            # NOTE that the returned data is actually in Unicode format
-            # Store each aaaSessionLR record into the list
-            result = "Success"
-            user = ""
-            # Search for Internal Relationship Objects that the APIC Automatically creates/deletes
-            # Hide these by default unless user wishes to see them as well
-            if re.search("Failure", entry["aaaSessionLR"]["attributes"]["descr"]):
-                result = "Failure"
-
-            if entry["aaaSessionLR"]["attributes"]["user"] == "":
-                # If APIC doesn't know the user, it returns a blank space, hence modifying to print UNKNOWN
-                user = "UNKNOWN"
+            attributes = entry["aaaSessionLR"]["attributes"]
+            records.append((attributes["id"], attributes["created"], attributes["user"], attributes["trig"],
+                            "Failure" if "Failure" in attributes["descr"] else "Success", get_source(attributes), attributes["descr"]))
+
+        # Records with the same timestamp as the newest stored record are returned again, and simply ignored
+        db.executemany('INSERT OR IGNORE INTO login_archive VALUES (?, ?, ?, ?, ?, ?, ?)', records)
+        db.commit()
+
+    return db.total_changes - changes_before
+
+
+def query_login_archive(db, args, sort):
+    '''
+    Answer the --start / --end / --user / --exclude-user / --action / --result filters from the local archive, without touching the APIC
+    Returns a cursor over (created, id, user, trig, result, source, descr)
+    '''
+    where = []
+    params = []
+    if args.start:
+        where.append('created > ?')
+        params.append(args.start)
+    if args.end:
+        where.append('created < ?')
+        params.append(args.end)
+    if args.user:
+        # Exact match, so the user index can be used
+        where.append('user = ?')
+        params.append("" if args.user == "UNKNOWN" else args.user)
+    if args.exclude_user:
+        for exclude_user in args.exclude_user.split(","):
+            if exclude_user == "UNKNOWN":
+                where.append("user != ''")
             else:
-                # If user only wants to report on UNKNOWN attempts.
-                # Since this else statement catches all other users
-                # if option is enabled, skip it, otherwise record the entry
-                if args.user == "UNKNOWN":
-                    continue
-                else:
-                    user = entry["aaaSessionLR"]["attributes"]["user"]
+                where.append('user NOT LIKE ?')
+                params.append('%' + exclude_user + '%')
+    if args.action:
+        where.append('trig = ?')
+        params.append(args.action)
+    if args.result:
+        where.append('result = ?')
+        params.append(args.result)
+
+    where_clause = ''
+    if len(where) >= 1:
+        where_clause = ' WHERE ' + ' AND '.join(where)
 
-            aaaSessionLR.append((entry["aaaSessionLR"]["attributes"]["created"],
-                             entry["aaaSessionLR"]["attributes"]["id"], user,
-                             entry["aaaSessionLR"]["attributes"]["trig"],
-                             entry["aaaSessionLR"]["attributes"]["descr"], result))
+    return db.execute('SELECT created, id, user, trig, result, source, descr FROM login_archive' + where_clause +
+                      ' ORDER BY created ' + ("ASC" if sort == "asc" else "DESC"), params)
 
-        # Print out all the data collected, change the headers depending on the --internal flag
-        print (tabulate(aaaSessionLR, headers = ["Timestamp", "ID", "User",
-                                                 "Action", "Description", "Result"],
-                        tablefmt="simple"))
 
+def print_archive_records(db, args):
+    '''
+    Print every archived record matching the filters, in --sort order
+    '''
+    cursor = query_login_archive(db, args, args.sort)
+    records_printed = 0
+    while True:
+        rows = cursor.fetchmany(10000)
+        if not rows:
+            break
+        print_session_rows([(created, record_id, user or "UNKNOWN", trig, descr, result)
+                            for created, record_id, user, trig, result, source, descr in rows], records_printed == 0)
+        records_printed += len(rows)
+
+    if records_printed == 0:
+        print ("Query returned no results. Try modifying your filters\n")
+    else:
         print ("=" * 80)
-        print ("Total records returned: " + str(total_count))
+        print ("Total records returned: " + str(records_printed))
         print ("=" * 80)
 
+
+def detect_archive(db, args):
+    '''
+    Run the archived records matching the filters through the detector, oldest first
+    '''
+    detector = LoginDetector(args.window, args.failure_threshold, args.unknown_threshold, args.spray_threshold)
+    alert_count = 0
+
+    for created, record_id, user, trig, result, source, descr in query_login_archive(db, args, "asc"):
+        alerts = detector.process({"created": created, "user": user, "trig": trig, "descr": descr, "remoteAddr": source})
+        if alerts:
+            print_alerts(alerts, alert_count == 0)
+            alert_count += len(alerts)
+
+    print ("=" * 80)
+    print ("Total records processed: " + str(detector.records))
+    print ("Total alerts raised: " + str(alert_count))
+    print ("=" * 80)
+
+
+def main():
+    description = ('Simple application that logs on to the APIC and displays the AAA logs')
+    creds = aci.Credentials('apic', description)
+    creds.add_argument('--start', help='Start Date/Time for the search until either --end date/time or current date/time. Full Format: 2018-02-23T08:14:25')
+    creds.add_argument('--end', help='End Date/Time for the search until either --start date/time or the beginning of the records. Full Format: 2018-02-23T08:14:25')
+    creds.add_argument('--user', help='Find records for a specific user. Default is all. Use "UNKNOWN" to see unknown attempts. Can also look for "root"')
+    creds.add_argument('--exclude-user', dest="exclude_user", help='Skip the records of these users, comma separated. Eg: svc-ansible,svc-backup. Use "UNKNOWN" to skip unknown attempts')
+    creds.add_argument('--action', choices=["login", "logout", "refresh"], help='Find records for this specific action. Default is all')
+    creds.add_argument('--result', choices=["Success", "Failure"], help='Specify an result to filter on. Default is all')
+    creds.add_argument('--sort', choices=["asc", "desc"], default="desc", help='Specify the sort order. Default is Descending. i.e. Newest logs at the top')
+    creds.add_argument('--page-size', dest="page_size", type=int, default=10000, help='Number of records retrieved per query. Default = 10000')
+    creds.add_argument('--workers', type=int, default=1, help='Number of pages retrieved in parallel. Default = 1')
+    creds.add_argument('--detect', action='store_true', help='Instead of printing the records, raise alerts for brute force / password spray attempts, unknown users and root activity')
+    creds.add_argument('--window', type=int, default=300, help='Sliding window in seconds used by --detect. Default = 300')
+    creds.add_argument('--failure-threshold', dest="failure_threshold", type=int, default=5, help='Failures of a user without a successful login within the window that raise an alert. Default = 5')
+    creds.add_argument('--unknown-threshold', dest="unknown_threshold", type=int, default=3, help='UNKNOWN user failures from a source within the window that raise an alert. Default = 3')
+    creds.add_argument('--spray-threshold', dest="spray_threshold", type=int, default=5, help='Different users failing from a source within the window that raise an alert. Default = 5')
+    creds.add_argument('--watch', type=int, help='With --detect, keep checking for new records every WATCH seconds, until interrupted with Ctrl-C')
+    # --archive never logs in to the APIC, so it cannot be combined with a sync
+    archive_mode = creds.add_mutually_exclusive_group()
+    archive_mode.add_argument('--archive-sync', dest="archive_sync", action='store_true', help='Store the records created since the last sync in the local login archive')
+    archive_mode.add_argument('--archive', action='store_true', help='Answer the query (or --detect) from the local login archive, without logging in to the APIC. --user is an exact match')
+    creds.add_argument('--archive-db', dest="archive_db", default=login_archive_filename, help='Local login archive. Default = {}'.format(login_archive_filename))
+    creds.add_argument('--debug', action='store_true', help='Print debug output')
+    args = creds.get()
+
+    # Login to APIC only if NOT querying the local login archive - as already have the data we need locally
+    if not args.archive:
+        session = aci.Session(args.url, args.login, args.password)
+        resp = session.login()
+        if not resp.ok:
+            print('%% Could not login to APIC')
+            exit(0)
+
+    # Start time count at this point, otherwise takes into consideration the amount of time taken to input the password
+    start_time = time.time()
+
+    if args.archive_sync:
+        db = open_login_archive(args.archive_db)
+        try:
+            new_records = sync_login_archive(session, db, args.page_size, args.workers)
+            print ("Login archive records stored: " + str(new_records) + ". Total records = " + str(db.execute('SELECT COUNT(*) FROM login_archive').fetchone()[0]))
+        finally:
+            db.close()
+
+    elif args.archive:
+        db = open_login_archive(args.archive_db)
+        try:
+            if args.detect:
+                print ("\nDetecting suspicious logins in the local archive...\n")
+                detect_archive(db, args)
+            else:
+                print_archive_records(db, args)
+        finally:
+            db.close()
+
+    elif args.detect:
+        print ("\nDetecting suspicious logins...\n")
+        detect(session, args)
+    else:
+        my_url = build_query_url(args, args.sort)
+        if "query-target-filter" in my_url:
+            print "\nAt least one custom filter is selected\n"
+        else:
+            print "\nNo custom filter selected\n"
+
+        print_records(session, my_url, args)
+
     print ("#" * 80)
     finish_time = time.time()
     print ("Started @ {}".format(time.asctime(time.localtime(start_time))))
@@ -10,11 +10,6 @@ https://github.com/datacenter/acitoolkit/blob/master/samples/aci-show-lldp.py
 
 Made various modifications to suit my needs
 
-To Do:
-    * Store in dictionary, with host+interface as key
-    * Can then display per host / per port neighbor information
-    * Be able to monitor these connections and if they differ during a subsequent run of the script, flag it to user
-
 Michael Petrinovic 2018
 """
 import acitoolkit.acitoolkit as aci
@@ -28,8 +23,637 @@ from acitoolkit import Node
 from acitoolkit.aciConcreteLib import ConcreteCdp
 from acitoolkit.aciConcreteLib import ConcreteLLdp
 from tabulate import tabulate
+from array import array
+from collections import defaultdict, deque
+from xml.sax.saxutils import quoteattr
+from multiprocessing.pool import ThreadPool
+import requests
+import json
+import os
+import re
 import time
 
+snapshot_filename = "aci_neighbours_snapshot.json" # Default snapshot file used by --save-snapshot and --diff
+
+def query_class(session, class_name, page_size):
+    '''
+    Return the attributes of every object of the class (Eg: cdpAdjEp / lldpAdjEp), using paginated class queries
+    '''
+    base_url = '/api/node/class/{}.json?order-by={}.dn'.format(class_name, class_name)
+    adjacencies = []
+    page = 0
+
+    while True:
+        ret = session.get(base_url + '&page-size={}&page={}'.format(page_size, page))
+        response = ret.json()
+        adjacencies += [entry[class_name]["attributes"] for entry in response['imdata']]
+
+        page += 1
+        if len(response['imdata']) < page_size or page * page_size >= int(response['totalCount']):
+            break
+
+    return adjacencies
+
+
+def get_node_id(node):
+    '''
+    Normalise a Node-ID to the format used by ConcreteCdp / ConcreteLLdp get_table, so every path keys the nodes the same way
+    Eg: 101, node-101 or topology/pod-1/node-101/sys/cdp/inst/if-[eth1/1]/adj-1 = node-101
+    '''
+    match = re.search(r'node-([0-9]+)', node)
+    return "node-" + (match.group(1) if match else node)
+
+
+def get_adjacency_rows(class_name, adjacencies):
+    '''
+    Convert the adjacency objects to the same table rows as ConcreteCdp / ConcreteLLdp get_table
+    The node and local interface are taken from the DN. Eg: topology/pod-1/node-101/sys/cdp/inst/if-[eth1/1]/adj-1
+    Returns a list of (local interface, table row)
+    '''
+    rows = []
+    for adj in adjacencies:
+        node_id = get_node_id(adj["dn"])
+        match = re.search(r'/if-\[(.+)\]/adj-', adj["dn"])
+        local_interface = match.group(1) if match else ""
+
+        if class_name == "cdpAdjEp":
+            rows.append((local_interface, [node_id, local_interface, adj["devId"], adj["platId"], adj["portId"]]))
+        else:
+            # Same as ConcreteLLdp: the chassis MAC when the chassis ID is a MAC address, otherwise the management port MAC
+            platform = adj["chassisIdV"] if adj["chassisIdT"] == "mac" else adj["mgmtPortMac"]
+            rows.append((local_interface, [node_id, adj["mgmtIp"], adj["sysName"], adj["chassisIdT"], platform, adj["portIdV"]]))
+
+    return rows
+
+
+def get_neighbours(session, protocol, page_size):
+    '''
+    Retrieve the CDP and/or LLDP adjacencies with targeted class queries, run concurrently when both are requested
+    Returns the CDP and LLDP lists of (local interface, table row)
+    '''
+    class_names = []
+    if protocol == "both" or protocol == "cdp":
+        class_names.append("cdpAdjEp")
+    if protocol == "both" or protocol == "lldp":
+        class_names.append("lldpAdjEp")
+
+    pool = ThreadPool(len(class_names))
+    try:
+        results = pool.map(lambda class_name: get_adjacency_rows(class_name, query_class(session, class_name, page_size)), class_names)
+    finally:
+        pool.close()
+
+    rows = dict(zip(class_names, results))
+    return rows.get("cdpAdjEp", []), rows.get("lldpAdjEp", [])
+
+
+def get_neighbours_deep(session, protocol):
+    '''
+    Retrieve the CDP and/or LLDP adjacencies from the full concrete object tree of every switch (slower)
+    Returns the CDP and LLDP lists of (local interface, table row). The LLDP table has no local interface, so it is None
+    '''
+    nodes = Node.get_deep(session, include_concrete=True)
+    cdp_rows = []
+    lldp_rows = []
+
+    if protocol == "both" or protocol == "cdp":
+        cdps = []
+        for node in nodes:
+            node_concrete_cdp = node.get_children(child_type=ConcreteCdp)
+            for node_concrete_cdp_obj in node_concrete_cdp:
+                cdps.append(node_concrete_cdp_obj)
+
+        tables = ConcreteCdp.get_table(cdps)
+        for table in tables:
+            cdp_rows += [(table_data[1], table_data) for table_data in table.data]
+
+    if protocol == "both" or protocol == "lldp":
+        lldps = []
+        for node in nodes:
+            node_concrete_lldp = node.get_children(child_type=ConcreteLLdp)
+            for node_concrete_lldp_obj in node_concrete_lldp:
+                lldps.append(node_concrete_lldp_obj)
+
+        tables = ConcreteLLdp.get_table(lldps)
+        for table in tables:
+            lldp_rows += [(None, table_data) for table_data in table.data]
+
+    return cdp_rows, lldp_rows
+
+
+def get_fabric_nodes(session, page_size):
+    '''
+    Returns Node-ID -> (name, role, pod) for every fabric node. Switches that are not active (Eg: decommissioned or
+    inactive) are left out, as they can not answer a query
+    Used to select the nodes to query, and to match the spines/leaves seen as LLDP/CDP neighbours to their Node-ID
+    '''
+    fabric_nodes = {}
+    for node in query_class(session, "fabricNode", page_size):
+        if node["role"] in ["leaf", "spine"] and node.get("fabricSt") != "active":
+            continue
+        # Eg: topology/pod-1/node-101
+        pod = re.search(r'/pod-([0-9]+)/', node["dn"]).group(1)
+        fabric_nodes[node["id"]] = (node["name"], node["role"], pod)
+
+    return fabric_nodes
+
+
+def select_nodes(fabric_nodes, node_filter, pod_filter):
+    '''
+    Returns the sorted list of (Node-ID, pod) of the switches matching the --node / --pod filters
+    The --node filter is a list of normalised Node-IDs (see get_node_id). The returned Node-IDs are the plain fabricNode id
+    '''
+    selected = []
+    for node_id, (name, role, pod) in fabric_nodes.iteritems():
+        if role not in ["leaf", "spine"]:
+            continue
+        if node_filter and get_node_id(node_id) not in node_filter:
+            continue
+        if pod_filter and pod != pod_filter:
+            continue
+        selected.append((node_id, pod))
+
+    return sorted(selected, key=lambda node: int(node[0]))
+
+
+def query_node_adjacencies(session, node_id, pod, class_names):
+    '''
+    Return the CDP/LLDP adjacencies of a single switch, from a subtree query of topology/pod-X/node-Y
+    Returns (Node-ID, adjacencies per class, error). The error is None unless the switch could not answer (Eg: unreachable)
+    '''
+    adjacencies = dict((class_name, []) for class_name in class_names)
+    try:
+        ret = session.get('/api/node/mo/topology/pod-{}/node-{}/sys.json?query-target=subtree&target-subtree-class={}'.format(
+            pod, node_id, ",".join(class_names)))
+        imdata = ret.json()['imdata']
+    except (requests.exceptions.RequestException, ValueError, KeyError) as error:
+        return node_id, adjacencies, str(error)
+
+    error = None
+    if not ret.ok:
+        error = "HTTP {}".format(ret.status_code)
+    for entry in imdata:
+        for class_name, mo in entry.iteritems():
+            if class_name == "error":
+                # Eg: {"error": {"attributes": {"code": "503", "text": "Unable to deliver the message, Resolve timeout"}}}
+                error = mo["attributes"].get("text", error)
+            elif class_name in adjacencies:
+                adjacencies[class_name].append(mo["attributes"])
+
+    return node_id, adjacencies, error
+
+
+def get_neighbours_per_node(session, nodes, protocol, workers, neighbour_index):
+    '''
+    Query each selected switch in parallel (at most <workers> at a time), adding its adjacencies to the index as soon as it returns
+    A switch that fails is reported and skipped, so the others are still collected. Returns the Node-IDs that failed
+    '''
+    class_names = []
+    if protocol == "both" or protocol == "cdp":
+        class_names.append("cdpAdjEp")
+    if protocol == "both" or protocol == "lldp":
+        class_names.append("lldpAdjEp")
+
+    failed_nodes = []
+    pool = ThreadPool(max(1, min(workers, len(nodes))))
+    try:
+        results = pool.imap_unordered(lambda node: query_node_adjacencies(session, node[0], node[1], class_names), nodes)
+        for completed, (node_id, adjacencies, error) in enumerate(results, 1):
+            if error is not None:
+                print ("[{}/{}] Node {}: FAILED ({})".format(completed, len(nodes), node_id, error))
+                failed_nodes.append(node_id)
+                continue
+            count = 0
+            for class_name in class_names:
+                for local_interface, table_data in get_adjacency_rows(class_name, adjacencies[class_name]):
+                    neighbour_index.add("cdp" if class_name == "cdpAdjEp" else "lldp", local_interface, table_data)
+                    count += 1
+            print ("[{}/{}] Node {}: {} adjacencies".format(completed, len(nodes), node_id, count))
+    finally:
+        pool.close()
+
+    return failed_nodes
+
+
+class NeighbourIndex(object):
+    '''
+    Index of the fabric links, keyed by Node-ID + Local Interface, merging the CDP and LLDP view of each link
+    Duplicate adjacencies are dropped on insert, and the per node / per neighbour device lookups are dictionary based
+    '''
+    def __init__(self):
+        self.links = {}
+        self.node_links = defaultdict(list)
+        self.device_links = defaultdict(dict)
+        self.rows = {"cdp": [], "lldp": []}
+
+    def add(self, protocol, local_interface, table_data):
+        '''
+        Add a CDP/LLDP table row. Returns False if the adjacency is already known
+        '''
+        node_id = get_node_id(table_data[0])
+        # Both the CDP and LLDP tables hold the neighbour device name in the 3rd column
+        device = table_data[2]
+        neighbour_interface = table_data[-1]
+
+        if local_interface:
+            key = (node_id, local_interface)
+        else:
+            # No local interface (LLDP from --get-deep), so the neighbour identifies the link instead
+            key = (node_id, "", device, neighbour_interface)
+
+        link = self.links.get(key)
+        if link is None:
+            link = {"node": node_id, "interface": local_interface or "", "cdp": {}, "lldp": {}}
+            self.links[key] = link
+            self.node_links[node_id].append(link)
+
+        adjacency = tuple(table_data)
+        if adjacency in link[protocol]:
+            return False
+
+        link[protocol][adjacency] = table_data
+        self.rows[protocol].append(table_data)
+        self.device_links[device.lower()][key] = link
+        return True
+
+    def get_port(self, node_id, local_interface):
+        link = self.links.get((get_node_id(node_id), local_interface))
+        return [link] if link else []
+
+    def get_node(self, node_id):
+        return self.node_links.get(get_node_id(node_id), [])
+
+    def get_device(self, device):
+        return self.device_links.get(device.lower(), {}).values()
+
+    def get_snapshot(self):
+        '''
+        Compact view of the index: "Node-ID|Local Interface" -> [Neighbour Device, Neighbour Platform, Neighbour Interface]
+        '''
+        return dict(("|".join(key), get_link_row(link)[2:5]) for key, link in self.links.iteritems())
+
+
+def get_link_row(link):
+    '''
+    Merge the CDP and LLDP adjacencies of a link into a single table row
+    '''
+    cdps = link["cdp"].values()
+    lldps = link["lldp"].values()
+
+    devices = [cdp[2] for cdp in cdps] or [lldp[2] for lldp in lldps]
+    platforms = [cdp[3] for cdp in cdps] or [lldp[4] for lldp in lldps]
+    interfaces = [cdp[4] for cdp in cdps] or [lldp[5] for lldp in lldps]
+    ips = [lldp[1] for lldp in lldps]
+    protocols = [protocol.upper() for protocol in ["cdp", "lldp"] if link[protocol]]
+
+    return [link["node"], link["interface"], ", ".join(devices), ", ".join(platforms), ", ".join(interfaces),
+            ", ".join(ips), "+".join(protocols)]
+
+
+def print_links(links):
+    '''
+    Print one merged row per link, sorted by Node-ID and Local Interface
+    '''
+    table = [get_link_row(link) for link in sorted(links, key=lambda link: (link["node"], link["interface"]))]
+
+    print ("=" * 100)
+    print ("Links: Total Entries [" + str(len(table)) + "]")
+    print ("=" * 100)
+    print(tabulate(table, headers=["Node-ID",
+                                   "Local Interface",
+                                   "Neighbour Device",
+                                   "Neighbour Platform",
+                                   "Neighbour Interface",
+                                   "Ip",
+                                   "Protocol"]))
+
+
+def load_snapshot(my_file):
+    '''
+    Read the neighbour snapshot written by a previous run. Returns None if no previous snapshot exists
+    Snapshots saved with a plain Node-ID (Eg: 101|eth1/1) are keyed again with the normalised Node-ID
+    '''
+    if not os.path.isfile(my_file):
+        return None
+
+    with open(my_file) as json_file:
+        snapshot = json.load(json_file)
+
+    snapshot["links"] = dict(("|".join([get_node_id(key.split("|")[0])] + key.split("|")[1:]), neighbour)
+                             for key, neighbour in snapshot["links"].iteritems())
+    return snapshot
+
+
+def write_snapshot(my_file, protocol, snapshot):
+    '''
+    Save the compact view of the links for the next --diff, with the protocol and time it was taken
+    '''
+    with open(my_file, 'w') as json_file:
+        json.dump({"protocol": protocol, "time": time.time(), "links": snapshot}, json_file, separators=(',', ':'))
+
+
+def diff_snapshot(previous, current):
+    '''
+    Compare two snapshots, keyed by link. Returns a list of (change, link, previous neighbour, current neighbour)
+    '''
+    changes = []
+    for key in set(current) - set(previous):
+        changes.append(("ADDED", key, [], current[key]))
+    for key in set(previous) - set(current):
+        changes.append(("REMOVED", key, previous[key], []))
+    for key in set(previous) & set(current):
+        if previous[key] != current[key]:
+            changes.append(("CHANGED", key, previous[key], current[key]))
+
+    return sorted(changes, key=lambda change: change[1])
+
+
+def print_snapshot_diff(previous, changes):
+    '''
+    Print the links ADDED / REMOVED / CHANGED since the previous snapshot, as returned by diff_snapshot
+    '''
+    print ("=" * 100)
+    print ("Changes since {}: Total Entries [{}]".format(time.asctime(time.localtime(previous["time"])), len(changes)))
+    print ("=" * 100)
+    table = []
+    for change, key, previous_neighbour, current_neighbour in changes:
+        link = key.split("|")
+        table.append([change, link[0], link[1], " / ".join(previous_neighbour), " / ".join(current_neighbour)])
+
+    print(tabulate(table, headers=["Change",
+                                   "Node-ID",
+                                   "Local Interface",
+                                   "Previous Neighbour (Device / Platform / Interface)",
+                                   "Current Neighbour (Device / Platform / Interface)"]))
+
+
+def get_device_name(device):
+    '''
+    CDP device IDs can carry the serial number. Eg: esxi-01(FOX1234ABCD)
+    '''
+    return device.split("(")[0].strip().lower()
+
+
+class TopologyGraph(object):
+    '''
+    Fabric topology built from the neighbour index. Every fabric node / neighbour device is an integer vertex ID,
+    every link an edge in the edge_src / edge_dst arrays, and the adjacency list is stored as compact arrays (offsets + edge IDs)
+    '''
+    def __init__(self, neighbour_index, fabric_nodes):
+        self.vertex_ids = {}
+        self.node_vertices = {}
+        self.names = []
+        self.roles = []
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.edge_interfaces = []
+
+        # Keyed by the normalised Node-ID (Eg: node-101), the same as the links
+        for node_id, (name, role, pod) in fabric_nodes.iteritems():
+            self.node_vertices[get_node_id(node_id)] = self.add_vertex(name, role)
+
+        for link in neighbour_index.links.itervalues():
+            if link["node"] not in self.node_vertices:
+                self.node_vertices[link["node"]] = self.add_vertex(link["node"], "leaf")
+            node_vertex = self.node_vertices[link["node"]]
+
+            # Prefer the CDP device ID, as per the merged link view
+            devices = [cdp[2] for cdp in link["cdp"].itervalues()] or [lldp[2] for lldp in link["lldp"].itervalues()]
+            for device in set(get_device_name(device) for device in devices):
+                self.edge_src.append(node_vertex)
+                self.edge_dst.append(self.add_vertex(device, "neighbour"))
+                self.edge_interfaces.append(link["interface"])
+
+        # Adjacency list: the edges of vertex v are adjacency[offsets[v]:offsets[v + 1]]
+        vertex_count = len(self.names)
+        self.offsets = array('i', [0] * (vertex_count + 1))
+        for vertex in self.edge_src + self.edge_dst:
+            self.offsets[vertex + 1] += 1
+        for vertex in xrange(vertex_count):
+            self.offsets[vertex + 1] += self.offsets[vertex]
+
+        self.adjacency = array('i', [0] * (2 * len(self.edge_src)))
+        position = self.offsets[:-1]
+        for edge in xrange(len(self.edge_src)):
+            for vertex in (self.edge_src[edge], self.edge_dst[edge]):
+                self.adjacency[position[vertex]] = edge
+                position[vertex] += 1
+
+    def add_vertex(self, name, role):
+        key = name.lower()
+        if key not in self.vertex_ids:
+            self.vertex_ids[key] = len(self.names)
+            self.names.append(name)
+            self.roles.append(role)
+        return self.vertex_ids[key]
+
+    def find_vertex(self, name):
+        '''
+        Look up a vertex by Node-ID (Eg: 101 or node-101) or by fabric node / neighbour device name
+        '''
+        if re.match(r'^(node-)?[0-9]+$', name) and get_node_id(name) in self.node_vertices:
+            return self.node_vertices[get_node_id(name)]
+        return self.vertex_ids.get(get_device_name(name))
+
+    def get_neighbours(self, vertex):
+        for position in xrange(self.offsets[vertex], self.offsets[vertex + 1]):
+            edge = self.adjacency[position]
+            yield edge, self.edge_src[edge] + self.edge_dst[edge] - vertex
+
+    def is_fabric(self, vertex):
+        return self.roles[vertex] != "neighbour"
+
+    def get_path(self, source, target, removed=None):
+        '''
+        Breadth first search. Returns the shortest list of vertices from source to target, or None if unreachable
+        '''
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            vertex = queue.popleft()
+            if vertex == target:
+                path = []
+                while vertex is not None:
+                    path.append(vertex)
+                    vertex = previous[vertex]
+                return path[::-1]
+
+            for edge, neighbour in self.get_neighbours(vertex):
+                if neighbour not in previous and neighbour != removed:
+                    previous[neighbour] = vertex
+                    queue.append(neighbour)
+
+        return None
+
+    def get_isolated(self, removed):
+        '''
+        Neighbour devices that can no longer reach any remaining fabric node once the removed vertex is gone
+        '''
+        visited = bytearray(len(self.names))
+        visited[removed] = 1
+        queue = deque()
+        for vertex in xrange(len(self.names)):
+            if self.is_fabric(vertex) and not visited[vertex]:
+                visited[vertex] = 1
+                queue.append(vertex)
+
+        while queue:
+            for edge, neighbour in self.get_neighbours(queue.popleft()):
+                if not visited[neighbour]:
+                    visited[neighbour] = 1
+                    queue.append(neighbour)
+
+        return [vertex for vertex in xrange(len(self.names)) if not visited[vertex]]
+
+    def get_single_homed(self):
+        '''
+        Neighbour devices connected to a single fabric node, even if over several links
+        Returns a list of (device vertex, fabric node vertex, local interfaces)
+        '''
+        single_homed = []
+        for vertex in xrange(len(self.names)):
+            if self.is_fabric(vertex):
+                continue
+
+            uplinks = defaultdict(list)
+            for edge, neighbour in self.get_neighbours(vertex):
+                if self.is_fabric(neighbour):
+                    uplinks[neighbour].append(self.edge_interfaces[edge])
+            if len(uplinks) == 1:
+                fabric_vertex, interfaces = uplinks.items()[0]
+                single_homed.append((vertex, fabric_vertex, sorted(interfaces)))
+
+        return single_homed
+
+    def get_articulation_points(self):
+        '''
+        Vertices whose failure splits the topology (Tarjan, iterative so large fabrics don't hit the recursion limit)
+        '''
+        vertex_count = len(self.names)
+        order = array('i', [-1] * vertex_count)
+        low = array('i', [0] * vertex_count)
+        points = set()
+        counter = 0
+
+        for root in xrange(vertex_count):
+            if order[root] != -1:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            root_children = 0
+            # Each entry: vertex, edge used to reach it, next position in the adjacency list
+            stack = [[root, -1, self.offsets[root]]]
+
+            while stack:
+                entry = stack[-1]
+                vertex, parent_edge, position = entry
+                if position < self.offsets[vertex + 1]:
+                    entry[2] += 1
+                    edge = self.adjacency[position]
+                    if edge == parent_edge:
+                        continue
+                    neighbour = self.edge_src[edge] + self.edge_dst[edge] - vertex
+                    if order[neighbour] == -1:
+                        order[neighbour] = low[neighbour] = counter
+                        counter += 1
+                        if vertex == root:
+                            root_children += 1
+                        stack.append([neighbour, edge, self.offsets[neighbour]])
+                    else:
+                        low[vertex] = min(low[vertex], order[neighbour])
+                else:
+                    stack.pop()
+                    if stack:
+                        parent = stack[-1][0]
+                        low[parent] = min(low[parent], low[vertex])
+                        if parent != root and low[vertex] >= order[parent]:
+                            points.add(parent)
+
+            if root_children > 1:
+                points.add(root)
+
+        return sorted(points)
+
+    def write_graphml(self, my_file):
+        with open(my_file, 'w') as graph_file:
+            graph_file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            graph_file.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+            graph_file.write('  <key id="name" for="node" attr.name="name" attr.type="string"/>\n')
+            graph_file.write('  <key id="role" for="node" attr.name="role" attr.type="string"/>\n')
+            graph_file.write('  <key id="interface" for="edge" attr.name="interface" attr.type="string"/>\n')
+            graph_file.write('  <graph id="fabric" edgedefault="undirected">\n')
+            for vertex, name in enumerate(self.names):
+                graph_file.write('    <node id="n{}"><data key="name">{}</data><data key="role">{}</data></node>\n'.format(
+                    vertex, quoteattr(name)[1:-1], self.roles[vertex]))
+            for edge, interface in enumerate(self.edge_interfaces):
+                graph_file.write('    <edge source="n{}" target="n{}"><data key="interface">{}</data></edge>\n'.format(
+                    self.edge_src[edge], self.edge_dst[edge], quoteattr(interface)[1:-1]))
+            graph_file.write('  </graph>\n</graphml>\n')
+
+    def write_dot(self, my_file):
+        with open(my_file, 'w') as graph_file:
+            graph_file.write('graph fabric {\n')
+            for vertex, name in enumerate(self.names):
+                shape = "box" if self.is_fabric(vertex) else "ellipse"
+                graph_file.write('  n{} [label={}, shape={}];\n'.format(vertex, quoteattr(name), shape))
+            for edge, interface in enumerate(self.edge_interfaces):
+                graph_file.write('  n{} -- n{} [label={}];\n'.format(self.edge_src[edge], self.edge_dst[edge], quoteattr(interface)))
+            graph_file.write('}\n')
+
+
+def run_graph_queries(graph, args):
+    '''
+    Answer the --path / --impact / --single-homed / --articulation-points queries and write the --graphml / --dot exports
+    '''
+    print ("Topology: {} vertices, {} links".format(len(graph.names), len(graph.edge_src)))
+
+    if args.path:
+        source, target = [graph.find_vertex(name) for name in args.path]
+        if source is None or target is None:
+            print ("Unknown node / device: {}".format(args.path[0] if source is None else args.path[1]))
+        else:
+            path = graph.get_path(source, target)
+            if path is None:
+                print ("{} can NOT reach {}".format(args.path[0], args.path[1]))
+            else:
+                print ("Path [" + str(len(path) - 1) + " hops]: " + " -> ".join(graph.names[vertex] for vertex in path))
+
+    if args.impact:
+        removed = graph.find_vertex(args.impact)
+        if removed is None:
+            print ("Unknown node / device: {}".format(args.impact))
+        else:
+            isolated = graph.get_isolated(removed)
+            print ("=" * 100)
+            print ("Devices isolated if " + graph.names[removed] + " fails: Total Entries [" + str(len(isolated)) + "]")
+            print ("=" * 100)
+            print(tabulate([[graph.names[vertex]] for vertex in isolated], headers=["Neighbour Device"]))
+
+    if args.single_homed:
+        single_homed = graph.get_single_homed()
+        print ("=" * 100)
+        print ("Single homed devices: Total Entries [" + str(len(single_homed)) + "]")
+        print ("=" * 100)
+        print(tabulate(sorted([graph.names[vertex], graph.names[fabric_vertex], ", ".join(interfaces)]
+                              for vertex, fabric_vertex, interfaces in single_homed),
+                       headers=["Neighbour Device", "Fabric Node", "Local Interface"]))
+
+    if args.articulation_points:
+        points = graph.get_articulation_points()
+        print ("=" * 100)
+        print ("Articulation points: Total Entries [" + str(len(points)) + "]")
+        print ("=" * 100)
+        print(tabulate([[graph.names[vertex], graph.roles[vertex]] for vertex in points], headers=["Name", "Role"]))
+
+    if args.graphml:
+        graph.write_graphml(args.graphml)
+        print ("GraphML written to: {}".format(args.graphml))
+
+    if args.dot:
+        graph.write_dot(args.dot)
+        print ("DOT written to: {}".format(args.dot))
+
+
 def main():
     """
     Main show Cdps routine
@@ -42,6 +666,25 @@ def main():
                    'and displays all the CDP/LLDP neighbours.')
     creds = ACI.Credentials('apic', description)
     creds.add_argument('--protocol', choices=["cdp", "lldp", "both"], default="both", help='Choose if you want to see CDP/LLDP or both. Default is both')
+    creds.add_argument('--page-size', dest="page_size", type=int, default=10000, help='Number of adjacencies retrieved per class query. Default = 10000')
+    creds.add_argument('--merged', action='store_true', help='Display one row per link, merging the CDP and LLDP neighbour information')
+    creds.add_argument('--show-node', dest="show_node", metavar='NODE', help='Only display the merged links of this Node-ID. Eg: 101')
+    creds.add_argument('--show-port', dest="show_port", nargs=2, metavar=('NODE', 'INTERFACE'), help='Only display the merged link of this Node-ID and Local Interface. Eg: 101 eth1/1')
+    creds.add_argument('--show-device', dest="show_device", metavar='DEVICE', help='Only display the merged links that see this neighbour device (case insensitive). Eg: esxi-01')
+    creds.add_argument('--save-snapshot', dest="save_snapshot", action='store_true', help='Save the neighbours of this run to the snapshot file')
+    creds.add_argument('--diff', action='store_true', help='Only report the links ADDED, REMOVED or CHANGED since the saved snapshot')
+    creds.add_argument('--snapshot-file', dest="snapshot_file", default=snapshot_filename, help='Snapshot file used by --save-snapshot and --diff. Default = ' + snapshot_filename)
+    creds.add_argument('--path', nargs=2, metavar=('SOURCE', 'TARGET'), help='Display the shortest path between two Node-IDs / device names. Eg: esxi-01 201')
+    creds.add_argument('--impact', metavar='NODE', help='Display the neighbour devices that lose all connectivity to the fabric if this Node-ID / device fails. Eg: 101')
+    creds.add_argument('--single-homed', dest="single_homed", action='store_true', help='Display the neighbour devices connected to a single fabric node')
+    creds.add_argument('--articulation-points', dest="articulation_points", action='store_true', help='Display the fabric nodes / devices whose failure splits the topology')
+    creds.add_argument('--graphml', metavar='FILE', help='Export the topology to a GraphML file')
+    creds.add_argument('--dot', metavar='FILE', help='Export the topology to a Graphviz DOT file')
+    creds.add_argument('--node', help='Only retrieve the neighbours of these Node-IDs, comma separated. Eg: 101,102')
+    creds.add_argument('--pod', help='Only retrieve the neighbours of the nodes in this pod. Eg: 1')
+    creds.add_argument('--per-node', dest="per_node", action='store_true', help='Retrieve the neighbours with one query per switch, even without --node / --pod')
+    creds.add_argument('--workers', type=int, default=8, help='Number of switches queried in parallel with --node / --pod / --per-node. Default = 8')
+    creds.add_argument('--get-deep', dest="get_deep", action='store_true', help='Retrieve the full concrete object tree of every switch instead of the targeted CDP/LLDP class queries (slower)')
     args = creds.get()
 
     # Login to APIC
@@ -57,63 +700,104 @@ def main():
     start_time = time.time()
 
     print ("Proceeding to next step...")
-    print ("Retrieving node information...")
-    nodes = Node.get_deep(session, include_concrete=True)
-    cdp_count = 0
-    lldp_count = 0
+    print ("Retrieving neighbour information...")
+    neighbour_index = NeighbourIndex()
+    fabric_nodes = None
+    selected_nodes = None
 
-    if args.protocol == "both" or args.protocol == "cdp":
-        print "Processing CDP Information..."
-        cdps = []
-        for node in nodes:
-            node_concrete_cdp = node.get_children(child_type=ConcreteCdp)
-            for node_concrete_cdp_obj in node_concrete_cdp:
-                cdps.append(node_concrete_cdp_obj)
+    if args.node or args.pod or args.per_node:
+        fabric_nodes = get_fabric_nodes(session, args.page_size)
+        node_filter = [get_node_id(node_id.strip()) for node_id in args.node.split(",")] if args.node else None
+        nodes = select_nodes(fabric_nodes, node_filter, args.pod)
+        print ("Querying {} switches, {} at a time...".format(len(nodes), args.workers))
+        failed_nodes = get_neighbours_per_node(session, nodes, args.protocol, args.workers, neighbour_index)
+        if args.node or args.pod or failed_nodes:
+            # The failed nodes are treated as not queried, so their saved links are neither reported as REMOVED nor dropped
+            selected_nodes = set(get_node_id(node[0]) for node in nodes) - set(get_node_id(node_id) for node_id in failed_nodes)
+        if failed_nodes:
+            print ("%% Could not retrieve the neighbours of {} switches: {}".format(len(failed_nodes), ", ".join(sorted(failed_nodes, key=int))))
+    else:
+        if args.get_deep:
+            cdp_rows, lldp_rows = get_neighbours_deep(session, args.protocol)
+        else:
+            cdp_rows, lldp_rows = get_neighbours(session, args.protocol, args.page_size)
 
-        tables = ConcreteCdp.get_table(cdps)
-        cdp_list = []
-        for table in tables:
-            for table_data in table.data:
-                #print table_data
-                if table_data not in cdp_list:
-                    cdp_list.append(table_data)
-                    cdp_count += 1
+        for local_interface, table_data in cdp_rows:
+            neighbour_index.add("cdp", local_interface, table_data)
+        for local_interface, table_data in lldp_rows:
+            neighbour_index.add("lldp", local_interface, table_data)
 
-        print ("=" * 100)
-        print ("CDP: Total Entries [" + str(cdp_count) + "]")
-        print ("=" * 100)
-        print tabulate(cdp_list, headers=["Node-ID",
-                                          "Local Interface",
-                                          "Neighbour Device",
-                                          "Neighbour Platform",
-                                          "Neighbour Interface"])
-
-    if args.protocol == "both" or args.protocol == "lldp":
-        print "Processing LLDP Information..."
-        lldps = []
-        for node in nodes:
-            node_concrete_lldp = node.get_children(child_type=ConcreteLLdp)
-            for node_concrete_lldp_obj in node_concrete_lldp:
-                lldps.append(node_concrete_lldp_obj)
+    previous = None
+    if args.diff or (args.save_snapshot and selected_nodes is not None):
+        previous = load_snapshot(args.snapshot_file)
 
-        tables = ConcreteLLdp.get_table(lldps)
-        lldp_list = []
-        for table in tables:
-            for table_data in table.data:
-                #print table_data
-                if table_data not in lldp_list:
-                    lldp_list.append(table_data)
-                    lldp_count += 1
+    if args.diff:
+        if previous is None:
+            print ("No previous snapshot found: {}. Run with --save-snapshot first".format(args.snapshot_file))
+        elif previous["protocol"] != args.protocol:
+            print ("The snapshot was taken with --protocol {}. Run the diff with the same protocol".format(previous["protocol"]))
+        else:
+            previous_links = previous["links"]
+            if selected_nodes is not None:
+                # Only the selected nodes were queried, so only compare their links
+                previous_links = dict((key, neighbour) for key, neighbour in previous_links.iteritems() if key.split("|")[0] in selected_nodes)
+            print_snapshot_diff(previous, diff_snapshot(previous_links, neighbour_index.get_snapshot()))
 
-        print ("=" * 100)
-        print ("LLDP: Total Entries [" + str(lldp_count) + "]")
-        print ("=" * 100)
-        print(tabulate(lldp_list, headers=["Node-ID",
-                                           "Ip",
-                                           "Name",
-                                           "Chassis_id_t",
-                                           "Neighbour Platform",
-                                           "Neighbour Interface"]))
+    elif args.path or args.impact or args.single_homed or args.articulation_points or args.graphml or args.dot:
+        if fabric_nodes is None:
+            fabric_nodes = get_fabric_nodes(session, args.page_size)
+        graph = TopologyGraph(neighbour_index, fabric_nodes)
+        run_graph_queries(graph, args)
+
+    elif args.show_node or args.show_port or args.show_device:
+        if args.show_node:
+            links = neighbour_index.get_node(args.show_node)
+        elif args.show_port:
+            links = neighbour_index.get_port(args.show_port[0], args.show_port[1])
+        else:
+            links = neighbour_index.get_device(args.show_device)
+        print_links(links)
+
+    elif args.merged:
+        print_links(neighbour_index.links.values())
+
+    else:
+        if args.protocol == "both" or args.protocol == "cdp":
+            print "Processing CDP Information..."
+            cdp_list = neighbour_index.rows["cdp"]
+
+            print ("=" * 100)
+            print ("CDP: Total Entries [" + str(len(cdp_list)) + "]")
+            print ("=" * 100)
+            print tabulate(cdp_list, headers=["Node-ID",
+                                              "Local Interface",
+                                              "Neighbour Device",
+                                              "Neighbour Platform",
+                                              "Neighbour Interface"])
+
+        if args.protocol == "both" or args.protocol == "lldp":
+            print "Processing LLDP Information..."
+            lldp_list = neighbour_index.rows["lldp"]
+
+            print ("=" * 100)
+            print ("LLDP: Total Entries [" + str(len(lldp_list)) + "]")
+            print ("=" * 100)
+            print(tabulate(lldp_list, headers=["Node-ID",
+                                               "Ip",
+                                               "Name",
+                                               "Chassis_id_t",
+                                               "Neighbour Platform",
+                                               "Neighbour Interface"]))
+
+    if args.save_snapshot:
+        snapshot = neighbour_index.get_snapshot()
+        if selected_nodes is not None and previous is not None and previous["protocol"] == args.protocol:
+            # Keep the links of the nodes that were not queried this time
+            for key, neighbour in previous["links"].iteritems():
+                if key.split("|")[0] not in selected_nodes:
+                    snapshot[key] = neighbour
+        write_snapshot(args.snapshot_file, args.protocol, snapshot)
+        print ("Snapshot saved to: {}".format(args.snapshot_file))
 
     print ("#" * 80)
     finish_time = time.time()
@@ -10,29 +10,557 @@ Requires the ACI Toolkit: pip install acitoolkit
 
 USAGE:
 # python aci_snapshot.py -u https://10.66.80.242 -l mipetrin
+# python aci_snapshot.py -u https://10.66.80.242 -l mipetrin --wait
+# python aci_snapshot.py -u https://10.66.80.242 -l mipetrin --tenant Prod,Dev
+# python aci_snapshot.py -u https://10.66.80.242 -l mipetrin --inventory fabrics.txt
+# python aci_snapshot.py -u https://10.66.80.242 -l mipetrin --diff ce2_before.tar.gz ce2_after.tar.gz
 
 Michael Petrinovic 2018
 """
 import acitoolkit.acitoolkit as aci
+from tabulate import tabulate
+from multiprocessing.pool import ThreadPool
+import xml.etree.cElementTree as ElementTree
+import copy
+import hashlib
+import json
+import re
+import sys
+import tarfile
+import time
+
+# Streams the JSON files of an export (requirements.txt). Without it, each JSON file of the archive is loaded in full, one at a time
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# configJob operational states that mean the export is still in progress
+export_running_states = ["pending", "queued", "running"]
+
+# Attributes ignored by --diff, as they are not configuration
+diff_ignored_attributes = ["dn", "rn", "status", "modTs", "uid", "lcOwn", "childAction"]
+
+# RN format of the common exported classes, built from their naming properties. Used by --diff, as the exported child objects carry no dn / rn
+rn_formats = {
+    "polUni": "uni",
+    "fvTenant": "tn-{name}",
+    "fvAp": "ap-{name}",
+    "fvAEPg": "epg-{name}",
+    "fvBD": "BD-{name}",
+    "fvCtx": "ctx-{name}",
+    "fvSubnet": "subnet-[{ip}]",
+    "fvRsBd": "rsbd",
+    "fvRsCtx": "rsctx",
+    "fvRsCons": "rscons-{tnVzBrCPName}",
+    "fvRsProv": "rsprov-{tnVzBrCPName}",
+    "fvRsConsIf": "rsconsIf-{tnVzCPIfName}",
+    "fvRsPathAtt": "rspathAtt-[{tDn}]",
+    "fvRsDomAtt": "rsdomAtt-[{tDn}]",
+    "fvRsNodeAtt": "rsnodeAtt-[{tDn}]",
+    "fvRsBDToOut": "rsBDToOut-{tnL3extOutName}",
+    "vzBrCP": "brc-{name}",
+    "vzSubj": "subj-{name}",
+    "vzRsSubjFiltAtt": "rssubjFiltAtt-{tnVzFilterName}",
+    "vzFilter": "flt-{name}",
+    "vzEntry": "e-{name}",
+    "l3extOut": "out-{name}",
+    "l3extLNodeP": "lnodep-{name}",
+    "l3extLIfP": "lifp-{name}",
+    "l3extInstP": "instP-{name}",
+    "l3extSubnet": "extsubnet-[{ip}]",
+    "l3extRsEctx": "rsectx",
+    "l3extRsL3DomAtt": "rsl3DomAtt",
+    "l3extRsNodeL3OutAtt": "rsnodeL3OutAtt-[{tDn}]",
+    "l3extRsPathL3OutAtt": "rspathL3OutAtt-[{tDn}]",
+    "l3extRsDynPathAtt": "rsdynPathAtt-[{tDn}]",
+    "l3extIp": "addr-[{addr}]",
+    "l3extMember": "mem-{side}",
+    "l3extLoopBackIfP": "lbp-[{addr}]",
+    "l3extVirtualLIfP": "vlifp-[{nodeDn}]-[{encap}]",
+    "ipRouteP": "rt-[{ip}]",
+    "ipNexthopP": "nh-[{nhAddr}]",
+    "bgpExtP": "bgpExtP",
+    "bgpPeerP": "peerP-[{addr}]",
+    "bgpAsP": "as",
+    "bgpLocalAsnP": "localasn",
+    "bgpRsPeerPfxPol": "rspeerPfxPol",
+    "ospfExtP": "ospfExtP",
+    "ospfIfP": "ospfIfP",
+    "l2extOut": "l2out-{name}",
+    "l2extInstP": "instP-{name}",
+    "infraInfra": "infra",
+    "infraAccPortP": "accportprof-{name}",
+    "infraHPortS": "hports-{name}-typ-{type}",
+    "infraPortBlk": "portblk-{name}",
+    "infraNodeP": "nprof-{name}",
+    "infraLeafS": "leaves-{name}-typ-{type}",
+    "infraNodeBlk": "nodeblk-{name}",
+    "infraAttEntityP": "attentp-{name}",
+    "fvnsVlanInstP": "vlanns-[{name}]-{allocMode}",
+    "fvnsEncapBlk": "from-[{from}]-to-[{to}]",
+    "physDomP": "phys-{name}",
+    "fabricInst": "fabric",
+}
+
+
+def get_export_jobs(session, policy_dn):
+    '''
+    Returns DN -> attributes of every configJob created by the export policy
+    '''
+    ret = session.get('/api/node/mo/uni/backupst/jobs-[{}].json?query-target=children&target-subtree-class=configJob'.format(policy_dn))
+    jobs = {}
+    for entry in ret.json()['imdata']:
+        job = entry["configJob"]["attributes"]
+        jobs[job["dn"]] = job
+
+    return jobs
+
+
+def wait_for_export(session, policy_dn, known_jobs, timeout, label="Export job", min_interval=1, max_interval=30):
+    '''
+    Poll the configJob created by the trigger until it leaves the pending/running states
+    The poll interval starts at min_interval and grows by 50% on each poll (up to max_interval), and starts over whenever the job changes state
+    Returns the final job attributes, or None if no finished job was seen before the timeout
+    '''
+    deadline = time.time() + timeout
+    interval = min_interval
+    last_state = None
+
+    while time.time() < deadline:
+        new_jobs = [job for job_dn, job in get_export_jobs(session, policy_dn).iteritems() if job_dn not in known_jobs]
+        if new_jobs:
+            job = new_jobs[0]
+            if job["operSt"] not in export_running_states:
+                return job
+            if job["operSt"] != last_state:
+                print ("{}: {}".format(label, job["operSt"]))
+                last_state = job["operSt"]
+                interval = min_interval
+
+        time.sleep(min(interval, max(0, deadline - time.time())))
+        interval = min(interval * 1.5, max_interval)
+
+    return None
+
+
+def get_export_outcome(job, error=None):
+    '''
+    Returns the outcome of an export as a single word for the summary tables. Eg: SUCCESS, FAILED, TIMEOUT or ERROR
+    '''
+    if error:
+        return "ERROR"
+    if job is None:
+        return "TIMEOUT"
+    return job["operSt"].upper()
+
+
+def print_export_result(job, duration):
+    print ("=" * 80)
+    if job is None:
+        print ("Export: TIMEOUT - no finished job after {:.0f} seconds".format(duration))
+    else:
+        print ("Export: {}".format(get_export_outcome(job)))
+        print ("File: {}".format(job.get("fileName") or "n/a"))
+        if job.get("details") or job.get("lastStepDescr"):
+            print ("Details: {}".format(job.get("details") or job.get("lastStepDescr")))
+    print ("Duration: {:.1f} seconds".format(duration))
+    print ("=" * 80)
+
+
+def get_tenants(session):
+    '''
+    Returns the sorted names of every tenant, used by --all-tenants
+    '''
+    ret = session.get('/api/node/class/fvTenant.json')
+    return sorted(entry["fvTenant"]["attributes"]["name"] for entry in ret.json()['imdata'])
+
+
+def run_export(session, payload, timeout, label):
+    '''
+    Trigger the export policy of the payload, and wait for the job it creates. Returns (final job attributes or None, error)
+    '''
+    policy_dn = payload["configExportP"]["attributes"]["dn"]
+    # Remember the existing jobs, so the one created by this trigger can be identified
+    known_jobs = get_export_jobs(session, policy_dn)
+
+    resp = session.push_to_apic('/api/node/mo/{}.json'.format(policy_dn), data=payload)
+    if not resp.ok:
+        return None, resp.text
+
+    return wait_for_export(session, policy_dn, known_jobs, timeout, label), None
+
+
+def snapshot_tenant(session, payload, tenant, timestamp, timeout, cleanup):
+    '''
+    Create and trigger a uniquely named export policy scoped to a single tenant, then wait for its job to finish
+    Returns (tenant, policy name, final job attributes or None, error, duration)
+    '''
+    # Policy names are limited to 64 characters. Long tenant names are shortened with a hash of the full name,
+    # so tenants that only differ after the first 40 characters still get their own policy
+    tenant_name = tenant
+    if len(tenant) > 49:
+        tenant_name = "{}-{}".format(tenant[:40], hashlib.sha1(tenant).hexdigest()[:8])
+    name = "{}-{}".format(tenant_name, timestamp)
+    tenant_payload = copy.deepcopy(payload)
+    attributes = tenant_payload["configExportP"]["attributes"]
+    attributes["dn"] = "uni/fabric/configexp-" + name
+    attributes["name"] = name
+    attributes["rn"] = "configexp-" + name
+    attributes["targetDn"] = "uni/tn-" + tenant # Only export this tenant
+    attributes["descr"] = "Snapshot of tenant " + tenant
+
+    start_time = time.time()
+    try:
+        job, error = run_export(session, tenant_payload, timeout, tenant)
+        duration = time.time() - start_time
+
+        if cleanup and job is not None:
+            # Only the export policy is removed, the snapshot itself is kept
+            session.push_to_apic('/api/node/mo/{}.json'.format(attributes["dn"]),
+                                 data={"configExportP": {"attributes": {"dn": attributes["dn"], "status": "deleted"}}})
+    except Exception as e:
+        return tenant, name, None, str(e), time.time() - start_time
+
+    return tenant, name, job, error, duration
+
+
+def snapshot_cluster(cluster, password, payload, timeout):
+    '''
+    Login to a single APIC cluster of the inventory, then trigger the export and wait for its job to finish, with that same session
+    Returns (cluster name, url, final job attributes or None, error, duration)
+    '''
+    name, url, login = cluster
+    start_time = time.time()
+    try:
+        session = aci.Session(url, login, password)
+        resp = session.login()
+        if not resp.ok:
+            return name, url, None, "Could not login to APIC", time.time() - start_time
+
+        job, error = run_export(session, payload, timeout, name)
+    except Exception as e:
+        return name, url, None, str(e), time.time() - start_time
+
+    return name, url, job, error, time.time() - start_time
+
+
+def run_parallel_exports(export_function, items, parallel):
+    '''
+    Run export_function on each item, at most <parallel> at a time, printing each outcome as soon as it finishes
+    Returns the list of (item, name, final job attributes or None, error, duration)
+    '''
+    results = []
+    pool = ThreadPool(max(1, min(parallel, len(items))))
+    try:
+        for result in pool.imap_unordered(export_function, items):
+            item, name, job, error, duration = result
+            print ("[{}/{}] {}: {}".format(len(results) + 1, len(items), item, get_export_outcome(job, error)))
+            results.append(result)
+    finally:
+        pool.close()
+
+    return results
+
+
+def print_export_summary(title, headers, results, start_time):
+    '''
+    Print one row per export. Returns True if every export succeeded
+    '''
+    table = []
+    for item, name, job, error, duration in sorted(results):
+        table.append([item, name, get_export_outcome(job, error), "{:.1f}".format(duration),
+                      job.get("fileName", "") if job else error or ""])
+
+    print ("=" * 100)
+    print (title + ": Total Entries [" + str(len(table)) + "]")
+    print ("=" * 100)
+    print(tabulate(table, headers=headers + ["Outcome", "Duration (s)", "File / Error"]))
+    print ("Total Duration: {:.1f} seconds".format(time.time() - start_time))
+
+    return all(job is not None and job["operSt"].startswith("success") for item, name, job, error, duration in results)
+
+
+def run_tenant_snapshots(session, payload, tenants, parallel, timeout, cleanup):
+    '''
+    Snapshot each tenant with its own export policy, at most <parallel> at a time. Returns True if every export succeeded
+    '''
+    timestamp = time.strftime("%Y%m%d%H%M%S")
+    start_time = time.time()
+    results = run_parallel_exports(lambda tenant: snapshot_tenant(session, payload, tenant, timestamp, timeout, cleanup), tenants, parallel)
+
+    return print_export_summary("Tenant Snapshots", ["Tenant", "Export Policy"], results, start_time)
+
+
+def load_inventory(my_file, default_login):
+    '''
+    Read the APIC clusters from the inventory file. One cluster per line: <name> <url> [<login>]
+    Returns a list of (name, url, login). Empty lines and lines starting with # are skipped
+
+    Raises ValueError, with the file name and line number, for a line that does not have 2 or 3 fields
+    '''
+    clusters = []
+    with open(my_file) as inventory_file:
+        for line_number, line in enumerate(inventory_file, 1):
+            fields = line.split()
+            if len(fields) == 0:
+                # Blank line
+                continue
+            if fields[0].startswith("#"):
+                # Comment line
+                continue
+            if len(fields) not in [2, 3]:
+                raise ValueError("{}:{}: expected \"<name> <url> [<login>]\", found {} fields: {}".format(
+                    my_file, line_number, len(fields), line.strip()))
+            clusters.append((fields[0], fields[1], fields[2] if len(fields) > 2 else default_login))
+
+    return clusters
+
+
+def run_fleet_snapshots(clusters, password, payload, parallel, timeout):
+    '''
+    Snapshot every cluster of the inventory, at most <parallel> at a time. Returns True if every export succeeded
+    '''
+    start_time = time.time()
+    results = run_parallel_exports(lambda cluster: snapshot_cluster(cluster, password, payload, timeout), clusters, parallel)
+
+    return print_export_summary("Fleet Snapshots", ["Cluster", "URL"], results, start_time)
+
+
+def get_object_config(attributes):
+    return dict((name, value) for name, value in attributes.iteritems() if name not in diff_ignored_attributes)
+
+
+def get_object_rn(class_name, attributes):
+    '''
+    Build the rn of an exported object from its naming properties, using the RN format of the class when it is known.
+    Otherwise the first naming property found is used with the class name: the relation target (tDn, then tn*Name), then the name.
+    With none of them, a hash of the configuration attributes (which include the unknown naming properties) tells the siblings apart.
+    Eg: fvRsPathAtt = rspathAtt-[topology/pod-1/paths-101/pathep-[eth1/1]], fooRsBar = fooRsBar-[uni/tn-common], fooBar = fooBar-3f786850e387
+    '''
+    if attributes.get("rn"):
+        return attributes["rn"]
+
+    if class_name in rn_formats:
+        try:
+            return rn_formats[class_name].format(**attributes)
+        except KeyError:
+            pass
+
+    target_names = sorted(name for name in attributes if re.match(r'^tn[A-Z][A-Za-z0-9]*Name$', name) and attributes[name])
+    if attributes.get("tDn"):
+        return "{}-[{}]".format(class_name, attributes["tDn"])
+    if target_names:
+        return "{}-{}".format(class_name, attributes[target_names[0]])
+    if attributes.get("name"):
+        return "{}-{}".format(class_name, attributes["name"])
+    return "{}-{}".format(class_name, hashlib.sha1(json.dumps(get_object_config(attributes), sort_keys=True)).hexdigest()[:12])
+
+
+def get_object_dn(parent_dn, class_name, attributes):
+    '''
+    The exported objects only carry their DN at the top of the tree, so it is built from the parent DN and the rn
+    '''
+    if attributes.get("dn"):
+        return attributes["dn"]
+
+    rn = get_object_rn(class_name, attributes)
+    return parent_dn + "/" + rn if parent_dn else rn
+
+
+def walk_json_objects(data):
+    '''
+    Walk a loaded JSON export. Yields (dn, class, attributes) for each object
+    '''
+    roots = data["imdata"] if "imdata" in data else [data]
+    stack = [(entry, "") for entry in reversed(roots)]
+    while stack:
+        entry, parent_dn = stack.pop()
+        for class_name, body in entry.iteritems():
+            attributes = body.get("attributes", {})
+            dn = get_object_dn(parent_dn, class_name, attributes)
+            yield dn, class_name, attributes
+            for child in reversed(body.get("children", [])):
+                stack.append((child, dn))
+
+
+def stream_json_objects(json_file):
+    '''
+    Parse a JSON export as a stream of events (ijson). Yields (dn, class, attributes) for each object
+    An object is complete at the end of its "attributes", and stays the parent DN until the end of its class body
+    '''
+    parents = [] # (prefix of the class body, dn)
+    attributes = None
+
+    for prefix, event, value in ijson.parse(json_file):
+        if attributes is not None:
+            if event == "end_map" and prefix == attributes_prefix:
+                class_name = prefix.split(".")[-2]
+                dn = get_object_dn(parents[-1][1] if parents else "", class_name, attributes)
+                yield dn, class_name, attributes
+                parents.append((prefix[:-len(".attributes")], dn))
+                attributes = None
+            elif event not in ["map_key", "start_map", "end_map", "start_array", "end_array"]:
+                attributes[prefix[len(attributes_prefix) + 1:]] = value
+        elif event == "start_map" and prefix.endswith(".attributes"):
+            attributes = {}
+            attributes_prefix = prefix
+        elif event == "end_map" and parents and prefix == parents[-1][0]:
+            parents.pop()
+
+
+def stream_xml_objects(xml_file):
+    '''
+    Parse an XML export as a stream. Yields (dn, class, attributes) for each object
+    '''
+    parents = []
+    for event, element in ElementTree.iterparse(xml_file, events=("start", "end")):
+        if event == "start":
+            dn = get_object_dn(parents[-1] if parents else "", element.tag, element.attrib)
+            yield dn, element.tag, dict(element.attrib)
+            parents.append(dn)
+        else:
+            parents.pop()
+            # Free the object as soon as it has been read
+            element.clear()
+
+
+def get_file_objects(file_name, export_file):
+    if file_name.endswith(".xml"):
+        return stream_xml_objects(export_file)
+    if ijson is not None:
+        return stream_json_objects(export_file)
+    return walk_json_objects(json.load(export_file))
+
+
+def get_snapshot_objects(my_file):
+    '''
+    Yields (dn, class, attributes) for every object of a snapshot: an exported tar.gz archive, or a single JSON / XML file
+    The archive is read as a stream, one file at a time
+    '''
+    if my_file.endswith(".json") or my_file.endswith(".xml"):
+        with open(my_file, 'rb') as export_file:
+            for snapshot_object in get_file_objects(my_file, export_file):
+                yield snapshot_object
+        return
+
+    archive = tarfile.open(my_file, "r|*")
+    try:
+        for member in archive:
+            if member.isfile() and (member.name.endswith(".json") or member.name.endswith(".xml")):
+                for snapshot_object in get_file_objects(member.name, archive.extractfile(member)):
+                    yield snapshot_object
+    finally:
+        archive.close()
+
+
+def get_attributes_hash(attributes):
+    return hashlib.sha1(json.dumps(get_object_config(attributes), sort_keys=True)).digest()[:12]
+
+
+def diff_snapshots(before_file, after_file):
+    '''
+    Compare two snapshots, keeping only a DN -> (class, attributes hash) index in memory:
+      1. Index the before snapshot
+      2. Stream the after snapshot against the index: ADDED if unknown, MODIFIED if the hash differs. What is left in the index was REMOVED
+      3. Stream the before snapshot again, only to read the attributes of the MODIFIED objects
+    Returns the lists of added (class, dn), removed (class, dn) and modified (dn, attribute, before, after)
+
+    Raises ValueError if two objects of the same snapshot get the same DN, rather than silently comparing the wrong objects
+    '''
+    index = {}
+    for dn, class_name, attributes in get_snapshot_objects(before_file):
+        if dn in index:
+            raise ValueError("Duplicate object DN in {}: {} ({})".format(before_file, dn, class_name))
+        index[dn] = (class_name, get_attributes_hash(attributes))
+
+    added = []
+    modified_after = {}
+    after_dns = set()
+    for dn, class_name, attributes in get_snapshot_objects(after_file):
+        if dn in after_dns:
+            raise ValueError("Duplicate object DN in {}: {} ({})".format(after_file, dn, class_name))
+        after_dns.add(dn)
+        before = index.pop(dn, None)
+        if before is None:
+            added.append((class_name, dn))
+        elif before[1] != get_attributes_hash(attributes):
+            modified_after[dn] = attributes
+
+    removed = [(class_name, dn) for dn, (class_name, attributes_hash) in index.iteritems()]
+    index = None
+    after_dns = None
+
+    modified = []
+    if modified_after:
+        for dn, class_name, attributes in get_snapshot_objects(before_file):
+            if dn not in modified_after:
+                continue
+            after = modified_after[dn]
+            for name in sorted(set(attributes) | set(after)):
+                if name not in diff_ignored_attributes and attributes.get(name) != after.get(name):
+                    modified.append((dn, name, attributes.get(name, ""), after.get(name, "")))
+
+    return sorted(added, key=lambda entry: entry[1]), sorted(removed, key=lambda entry: entry[1]), sorted(modified)
+
+
+def print_snapshot_diff(added, removed, modified):
+    print ("=" * 100)
+    print ("ADDED: Total Entries [" + str(len(added)) + "]")
+    print ("=" * 100)
+    print(tabulate(added, headers=["Class", "DN"]))
+
+    print ("=" * 100)
+    print ("REMOVED: Total Entries [" + str(len(removed)) + "]")
+    print ("=" * 100)
+    print(tabulate(removed, headers=["Class", "DN"]))
+
+    print ("=" * 100)
+    print ("MODIFIED: Total Entries [" + str(len(set(entry[0] for entry in modified))) + " objects, " + str(len(modified)) + " attributes]")
+    print ("=" * 100)
+    print(tabulate(modified, headers=["DN", "Attribute", "Before", "After"]))
+
 
 def main():
     description = ('Simple application that logs on to the APIC and displays the AAA logs')
     creds = aci.Credentials('apic', description)
     creds.add_argument('--target', choices=["apic", "remote"], default="apic", help='The location where you would like the snapshot to be saved')
+    creds.add_argument('--wait', action='store_true', help='Wait for the export job to finish and report its outcome, file name and duration. Exits with 1 if it did not succeed')
+    creds.add_argument('--timeout', type=int, default=1800, help='Maximum number of seconds to wait with --wait / --tenant / --inventory. Default = 1800')
+    creds.add_argument('--tenant', help='Take a separate snapshot of each of these tenants, comma separated, and wait for them to finish. Eg: Prod,Dev')
+    creds.add_argument('--all-tenants', dest="all_tenants", action='store_true', help='Take a separate snapshot of every tenant, and wait for them to finish')
+    creds.add_argument('--parallel', type=int, default=5, help='Maximum number of tenant / cluster snapshots running at the same time. Default = 5')
+    creds.add_argument('--cleanup', action='store_true', help='Delete the per tenant export policies once finished. The snapshots are kept')
+    creds.add_argument('--inventory', help='Take a snapshot of every APIC cluster listed in this file (one "<name> <url> [<login>]" per line), with the -l login and password unless specified, and wait for them to finish')
+    creds.add_argument('--diff', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare 2 exported snapshots (tar.gz, or a single JSON / XML file) and display the objects ADDED, REMOVED and MODIFIED. Does not login to the APIC')
     args = creds.get()
 
-    # Login to APIC
-    session = aci.Session(args.url, args.login, args.password)
-    resp = session.login()
-    if not resp.ok:
-        print('%% Could not login to APIC')
-        exit(0)
+    # Comparing the local snapshot files does not need the APIC, so any password can be entered
+    if args.diff:
+        start_time = time.time()
+        try:
+            print_snapshot_diff(*diff_snapshots(args.diff[0], args.diff[1]))
+        except ValueError as e:
+            print ("%% Could not compare the snapshots: {}".format(e))
+            sys.exit(1)
+        print ("Total Duration: {:.1f} seconds".format(time.time() - start_time))
+        return
+
+    # With --inventory, every cluster has its own session, so -u is not used
+    if not args.inventory:
+        # Login to APIC
+        session = aci.Session(args.url, args.login, args.password)
+        resp = session.login()
+        if not resp.ok:
+            print('%% Could not login to APIC')
+            exit(0)
 
     base_url = '/api/node/mo/uni/fabric/configexp-defaultOneTime.json'
     my_url = args.url + base_url
 
-    print("\nAPI Call to URL:")
-    print(my_url + "\n")
+    if not (args.tenant or args.all_tenants or args.inventory):
+        print("\nAPI Call to URL:")
+        print(my_url + "\n")
 
     if args.target == "apic":
         print ("Will save to the APIC\n")
@@ -85,7 +613,31 @@ def main():
         }
         target_payload = remote_location_payload
 
+    if args.inventory:
+        try:
+            clusters = load_inventory(args.inventory, args.login)
+        except ValueError as e:
+            print ("%% Invalid inventory: {}".format(e))
+            sys.exit(1)
+        print ("Taking a snapshot of {} clusters, {} at a time...".format(len(clusters), args.parallel))
+        if not run_fleet_snapshots(clusters, args.password, target_payload, args.parallel, args.timeout):
+            sys.exit(1)
+        return
+
+    if args.tenant or args.all_tenants:
+        tenants = args.tenant.split(",") if args.tenant else get_tenants(session)
+        print ("Taking a snapshot of {} tenants, {} at a time...".format(len(tenants), args.parallel))
+        if not run_tenant_snapshots(session, target_payload, tenants, args.parallel, args.timeout, args.cleanup):
+            sys.exit(1)
+        return
+
+    policy_dn = target_payload["configExportP"]["attributes"]["dn"]
+    if args.wait:
+        # Remember the existing jobs, so the one created by this trigger can be identified
+        known_jobs = get_export_jobs(session, policy_dn)
+
     # Push this payload to the APIC
+    start_time = time.time()
     resp = session.push_to_apic(base_url, data=target_payload)
 
     if resp.ok:
@@ -94,6 +646,15 @@ def main():
     if not resp.ok:
         print('%% Error: Could not push configuration to APIC')
         print(resp.text)
+        if args.wait:
+            sys.exit(1)
+
+    if args.wait:
+        print ("Waiting for the export job to finish...")
+        job = wait_for_export(session, policy_dn, known_jobs, args.timeout)
+        print_export_result(job, time.time() - start_time)
+        if job is None or not job["operSt"].startswith("success"):
+            sys.exit(1)
 
 if __name__ == '__main__':
     main()